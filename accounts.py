@@ -0,0 +1,159 @@
+# Pool of Shopee affiliate accounts, one cookie file per account (ACCOUNTS_DIR/<name>.json, same
+# format as cookie.json). Each account keeps its own session state: login health, consecutive
+# captchas and a cooldown during which no browser may use it. Browsers bind to the least-loaded
+# available account, and the BrowserPool hands jobs to the waiting worker whose account did the
+# fewest jobs recently, so traffic is spread over all healthy accounts instead of bursting on one.
+
+import glob
+import os
+import threading
+import time
+from collections import deque
+
+LOAD_WINDOW = 600  # seconds of job history used to compare account load
+CAPTCHA_COOLDOWN = 600  # base cooldown after a captcha, doubled per consecutive hit
+LOGIN_COOLDOWN = 300  # base cooldown after a failed login, doubled per consecutive failure
+MAX_BACKOFF = 8  # cap of the cooldown multiplier
+
+
+class NoAccountAvailable(Exception):
+    """Every account is cooling down; retry_in is the number of seconds until the first one is usable"""
+
+    def __init__(self, retry_in):
+        super().__init__(f"No account available, retry in {retry_in}s")
+        self.retry_in = retry_in
+
+
+class Account:
+    def __init__(self, name, cookie_file):
+        self.name = name
+        self.cookie_file = cookie_file
+        self.healthy = None  # None until the first login attempt
+        self.bound = 0  # browsers currently logged in with this account
+        self.cooldown_until = 0.0
+        self.captchas = 0
+        self.consecutive_captchas = 0
+        self.login_failures = 0
+        self.consecutive_failures = 0
+        self.jobs_done = 0
+        self.last_used = 0.0
+        self.last_error = None
+        self._recent_jobs = deque()
+
+    def available(self, now):
+        return now >= self.cooldown_until
+
+    def recent_jobs(self, now):
+        while self._recent_jobs and self._recent_jobs[0] < now - LOAD_WINDOW:
+            self._recent_jobs.popleft()
+        return len(self._recent_jobs)
+
+    def info(self, now):
+        return {
+            "name": self.name,
+            "healthy": self.healthy,
+            "available": self.available(now),
+            "cooldown_remaining": max(0, round(self.cooldown_until - now)),
+            "bound_browsers": self.bound,
+            "recent_jobs": self.recent_jobs(now),
+            "jobs_done": self.jobs_done,
+            "captchas": self.captchas,
+            "login_failures": self.login_failures,
+            "last_error": self.last_error,
+        }
+
+
+def _backoff(base, count):
+    return base * min(2 ** max(count - 1, 0), MAX_BACKOFF)
+
+
+class AccountPool:
+    """All accounts of ACCOUNTS_DIR with their session state; every method is thread-safe"""
+
+    def __init__(self, accounts_dir, captcha_cooldown=CAPTCHA_COOLDOWN, login_cooldown=LOGIN_COOLDOWN):
+        self.accounts_dir = os.path.abspath(accounts_dir)
+        self.captcha_cooldown = captcha_cooldown
+        self.login_cooldown = login_cooldown
+        files = sorted(glob.glob(os.path.join(self.accounts_dir, "*.json")))
+        self.accounts = [Account(os.path.splitext(os.path.basename(f))[0], f) for f in files]
+        if not self.accounts:
+            raise ValueError(f"No account cookie file (*.json) in {self.accounts_dir}")
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.accounts)
+
+    def acquire(self):
+        """Bind a browser to the available account with the fewest browsers and recent jobs"""
+        now = time.time()
+        with self._lock:
+            free = [a for a in self.accounts if a.available(now)]
+            if not free:
+                raise NoAccountAvailable(self._next_available_in(now))
+            account = min(free, key=lambda a: (a.bound, a.recent_jobs(now), a.last_used))
+            account.bound += 1
+            account.last_used = now
+            return account
+
+    def release(self, account):
+        if account is None:
+            return
+        with self._lock:
+            account.bound = max(0, account.bound - 1)
+
+    def _next_available_in(self, now):
+        return max(1, round(min(a.cooldown_until for a in self.accounts) - now))
+
+    def is_available(self, account):
+        return account.available(time.time())
+
+    def load_key(self, account):
+        """Sort key of the scheduler: accounts that did fewer jobs lately (then idle longest) go first"""
+        now = time.time()
+        with self._lock:
+            return account.recent_jobs(now), account.last_used
+
+    def job_started(self, account):
+        now = time.time()
+        with self._lock:
+            account._recent_jobs.append(now)
+            account.last_used = now
+
+    def job_finished(self, account, ok):
+        with self._lock:
+            account.jobs_done += 1
+            if ok:
+                account.consecutive_captchas = 0
+
+    def report_login(self, account, ok, error=None):
+        with self._lock:
+            account.healthy = bool(ok)
+            if ok:
+                account.consecutive_failures = 0
+                account.last_error = None
+                return
+            account.login_failures += 1
+            account.consecutive_failures += 1
+            account.last_error = error or "login failed"
+            account.cooldown_until = time.time() + _backoff(self.login_cooldown, account.consecutive_failures)
+
+    def report_captcha(self, account):
+        """Put the account on cooldown; repeated captchas without a clean job in between back off further"""
+        with self._lock:
+            account.captchas += 1
+            account.consecutive_captchas += 1
+            account.last_error = "captcha"
+            cooldown = _backoff(self.captcha_cooldown, account.consecutive_captchas)
+            account.cooldown_until = max(account.cooldown_until, time.time() + cooldown)
+            return cooldown
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            accounts = [a.info(now) for a in self.accounts]
+        return {
+            "total": len(accounts),
+            "available": sum(1 for a in accounts if a["available"]),
+            "healthy": sum(1 for a in accounts if a["healthy"]),
+            "accounts": accounts,
+        }
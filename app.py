@@ -1,17 +1,64 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 import os
-import subprocess
 import json
 import time
+import threading
 from pathlib import Path
 from datetime import datetime
 
+import search_shopee_affiliate as scraper
+from accounts import AccountPool
+from browser_lifecycle import RecyclePolicy
+from browser_pool import BrowserPool, QueueFullError
+from captcha_detector import captcha_log
+from chrome_profiles import ProfilePool
+from job_store import JobStore
+from job_registry import JobRegistry, TERMINAL_STATUSES
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Registry
+from network_capture import load_products
+from parse_shopee_affiliate import parse_percent, read_and_sort_affiliate_links
+from resource_blocker import block_patterns
+from result_cache import ResultCache, search_key
+from single_flight import SingleFlight
+from webhooks import WebhookDispatcher
+
 # ============== CONFIG ==============
 app = Flask(__name__)
-DOWNLOAD_DIR = Path("./downloads")
-CSV_PATH = Path("./downloads/shopee_affiliate_links.csv")
-JOBS_FILE = Path("./jobs_status.json")
+DOWNLOAD_DIR = Path("./downloads")  # mỗi job có thư mục riêng: downloads/<job_id>/
+JOBS_FILE = Path("./jobs_status.json")  # chỉ dùng để import 1 lần vào JOBS_DB
+JOBS_DB = Path(os.environ.get("JOBS_DB", "./jobs.db"))
+RESULT_CACHE_TTL = int(os.environ.get("RESULT_CACHE_TTL", "900"))  # giây
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", "256"))
+JOB_RESULTS_MEMORY = int(os.environ.get("JOB_RESULTS_MEMORY", "128"))  # số job giữ kết quả đã serialize trong RAM
+CSV_DOWNLOAD_WAIT = float(os.environ.get("CSV_DOWNLOAD_WAIT", "15"))  # giây chờ Chrome tải xong CSV (download native)
 LOG_FILE = "app.log"
+BROWSER_POOL_SIZE = int(os.environ.get("BROWSER_POOL_SIZE", "1"))  # số Chrome worker chạy song song
+MAX_CONCURRENT_SCRAPES = int(os.environ.get("MAX_CONCURRENT_SCRAPES", str(BROWSER_POOL_SIZE)))
+JOB_QUEUE_MAX = int(os.environ.get("JOB_QUEUE_MAX", "20"))  # vượt quá -> 429 + Retry-After
+CHROME_PROFILES_DIR = os.environ.get("CHROME_PROFILES_DIR", "")  # rỗng = mỗi Chrome dùng profile trắng + cookie.json
+ACCOUNTS_DIR = os.environ.get("ACCOUNTS_DIR", "")  # thư mục <tên tài khoản>.json, rỗng = chỉ dùng cookie.json
+ACCOUNT_CAPTCHA_COOLDOWN = int(os.environ.get("ACCOUNT_CAPTCHA_COOLDOWN", "600"))  # giây nghỉ sau captcha
+# Thay Chrome (khởi động sẵn Chrome mới trước khi tắt Chrome cũ) sau N job hoặc khi vượt ngân sách bộ nhớ, 0 = tắt
+BROWSER_MAX_JOBS = int(os.environ.get("BROWSER_MAX_JOBS", "200"))
+BROWSER_MAX_RSS_MB = int(os.environ.get("BROWSER_MAX_RSS_MB", "1500"))  # tổng RSS browser + renderer + gpu...
+BROWSER_MAX_JS_HEAP_MB = int(os.environ.get("BROWSER_MAX_JS_HEAP_MB", "512"))  # JS heap của trang offer
+MAX_POLL_WAIT = 60  # giây, giới hạn tham số wait của /polling
+SSE_KEEPALIVE = 15  # giây giữa 2 comment keepalive của /events
+BATCH_MAX_KEYWORDS = int(os.environ.get("BATCH_MAX_KEYWORDS", "200"))
+MAX_PAGES_LIMIT = int(os.environ.get("MAX_PAGES_LIMIT", "25"))  # giới hạn max_pages của 1 search
+scraper.MAX_PAGES = MAX_PAGES_LIMIT  # số trang tối đa khi chỉ có min_commission_rate quyết định lúc dừng
+TABS_PER_BROWSER = int(os.environ.get("TABS_PER_BROWSER", "1"))  # số tab chạy song song trong 1 Chrome khi chạy batch
+CAPTURE_PRODUCTS = os.environ.get("CAPTURE_PRODUCTS", "0") == "1"  # bắt JSON search của trang offer qua CDP -> products.json
+scraper.CAPTURE_NETWORK = CAPTURE_PRODUCTS
+# loại tài nguyên bị chặn khi scrape (image, font, media, tracker), "none" = không chặn gì
+BLOCK_RESOURCES = os.environ.get("BLOCK_RESOURCES", ",".join(scraper.BLOCK_RESOURCES))
+scraper.BLOCK_RESOURCES = tuple(c.strip() for c in BLOCK_RESOURCES.split(",") if c.strip() and c.strip() != "none")
+scraper.EXTRA_BLOCKED_URLS = [p.strip() for p in os.environ.get("BLOCKED_URLS", "").split(",") if p.strip()]
+try:
+    # kiểm tra 1 lần khi khởi động, tránh để mọi lần mở Chrome đều lỗi vì gõ sai tên loại
+    block_patterns(scraper.BLOCK_RESOURCES, scraper.EXTRA_BLOCKED_URLS)
+except ValueError as e:
+    raise SystemExit(f"BLOCK_RESOURCES không hợp lệ: {e}")
 
 import logging
 import sys
@@ -34,52 +81,563 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+job_store = JobStore(JOBS_DB)
+job_registry = JobRegistry(job_store)  # /polling đọc từ RAM, ghi xuống job_store theo batch (start bên dưới)
+result_cache = ResultCache(ttl=RESULT_CACHE_TTL, max_entries=RESULT_CACHE_MAX_ENTRIES)
+job_results = ResultCache(ttl=24 * 3600, max_entries=JOB_RESULTS_MEMORY)  # job_id -> kết quả đã parse + JSON bytes
+single_flight = SingleFlight()  # mỗi (keyword, sub_ids) chỉ 1 lần chạy Chrome tại 1 thời điểm
+webhooks = WebhookDispatcher()  # POST kết quả job tới callback_url khi job kết thúc
+webhooks.start()
+_job_id_lock = threading.Lock()
+_last_job_ms = 0
+browser_pool = None
+_browser_pool_lock = threading.Lock()
+_batch_lock = threading.Lock()  # 1 batch chỉ kết thúc (và gửi webhook) 1 lần
+
+# ============== METRICS ==============
+metrics = Registry()
+http_requests = metrics.counter("http_requests_total", "Số request HTTP theo route", ("route", "method", "status"))
+http_latency = metrics.histogram("http_request_duration_seconds", "Thời gian xử lý request HTTP", ("route", "method"))
+job_duration = metrics.histogram("job_duration_seconds", "Thời gian job từ lúc tạo tới khi kết thúc", ("outcome",),
+                                 buckets=(1, 2, 5, 10, 20, 30, 45, 60, 90, 120, 180, 300, 600))
+blocked_requests = metrics.counter("blocked_requests_total", "Số request bị chặn khi scrape theo loại tài nguyên",
+                                   ("type",))
+blocked_bytes = metrics.counter("blocked_bytes_estimated_total", "Ước lượng số byte không phải tải nhờ chặn tài nguyên")
+browser_recycles = metrics.counter("browser_recycles_total", "Số lần thay Chrome theo lý do", ("reason",))
+browser_rss = metrics.gauge("browser_rss_megabytes", "RSS của Chrome (browser + renderer + ...) theo worker", ("worker",))
+browser_js_heap = metrics.gauge("browser_js_heap_megabytes", "JS heap đang dùng của trang offer theo worker",
+                                ("worker",))
+queue_depth = metrics.gauge("job_queue_depth", "Số job đang chờ trong hàng đợi của browser pool")
+active_scrapes = metrics.gauge("scrapes_active", "Số job đang chạy trên Chrome")
+ready_browsers = metrics.gauge("browser_workers_ready", "Số Chrome worker đã đăng nhập sẵn")
+captcha_checks = metrics.counter("captcha_checks_total", "Số lần kiểm tra trang captcha (is_captcha_page)")
+captcha_hits = metrics.counter("captcha_hits_total", "Số lần gặp trang captcha")
+account_available = metrics.gauge("account_available", "Tài khoản có dùng được không (0 = đang cooldown)",
+                                  ("account",))
+account_jobs = metrics.counter("account_jobs_total", "Số job đã chạy theo tài khoản", ("account",))
+account_captchas = metrics.counter("account_captchas_total", "Số lần gặp captcha theo tài khoản", ("account",))
+cache_hits = metrics.counter("result_cache_hits_total", "Số lần search lấy kết quả từ cache")
+cache_misses = metrics.counter("result_cache_misses_total", "Số lần search không có trong cache")
+cache_hit_ratio = metrics.gauge("result_cache_hit_ratio", "Tỉ lệ cache hit của search")
+searches_in_flight = metrics.gauge("searches_in_flight", "Số search (key) đang chạy Chrome")
+searches_coalesced = metrics.gauge("searches_coalesced", "Số job con đang chờ search giống hệt đang chạy")
+csv_bytes = metrics.histogram("csv_size_bytes", "Kích thước file CSV của job",
+                              buckets=(1024, 4096, 16384, 65536, 262144, 1048576, 4194304))
+csv_rows = metrics.histogram("csv_rows", "Số dòng kết quả trong CSV của job",
+                             buckets=(0, 10, 25, 50, 100, 250, 500, 1000, 2500))
+
+@metrics.collector
+def collect_runtime_metrics():
+    """Đọc các giá trị do pool / scraper / cache tự đếm lúc /metrics được scrape"""
+    if browser_pool:
+        stats = browser_pool.stats()
+        queue_depth.set(stats["pending"])
+        active_scrapes.set(stats["active"])
+        ready_browsers.set(stats["ready"])
+        for reason, count in stats["recycles"].items():
+            browser_recycles.set(count, reason=reason)
+        for browser in stats["browsers"]:
+            memory = browser["memory_mb"] or {}
+            if "rss_total" in memory:
+                browser_rss.set(memory["rss_total"], worker=browser["worker"])
+            if "js_heap_used" in memory:
+                browser_js_heap.set(memory["js_heap_used"], worker=browser["worker"])
+        for account in (stats["accounts"] or {}).get("accounts", []):
+            account_available.set(int(account["available"]), account=account["name"])
+            account_jobs.set(account["jobs_done"], account=account["name"])
+            account_captchas.set(account["captchas"], account=account["name"])
+    captcha = captcha_log.stats()
+    captcha_checks.set(captcha["checks"])
+    captcha_hits.set(captcha["hits"])
+    cache = result_cache.stats()
+    cache_hits.set(cache["hits"])
+    cache_misses.set(cache["misses"])
+    cache_hit_ratio.set(cache["hit_ratio"])
+    flights = single_flight.stats()
+    searches_in_flight.set(flights["in_flight"])
+    searches_coalesced.set(flights["followers"])
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    started = getattr(g, "request_started", None)
+    if started is not None:
+        http_latency.observe(time.perf_counter() - started, route=route, method=request.method)
+    http_requests.inc(route=route, method=request.method, status=response.status_code)
+    return response
+
 # ============== HELPER FUNCTIONS ==============
 def ensure_download_dir():
     """Tạo thư mục downloads nếu chưa tồn tại"""
     DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
-def load_jobs_status():
-    """Tải trạng thái jobs từ file JSON"""
+def import_legacy_jobs():
+    """Import 1 lần jobs_status.json cũ vào job store (chỉ khi store còn trống)"""
     try:
-        if JOBS_FILE.exists():
-            with open(JOBS_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
+        if JOBS_FILE.exists() and job_store.count() == 0:
+            added = job_store.import_json(JOBS_FILE)
+            logger.info(f"Đã import {added} job từ {JOBS_FILE} vào {JOBS_DB}")
     except Exception as e:
-        logger.warning(f"Lỗi khi load jobs status: {e}")
-    return {}
+        logger.warning(f"Lỗi khi import {JOBS_FILE}: {e}")
 
-def save_jobs_status(jobs):
-    """Lưu trạng thái jobs vào file JSON"""
-    try:  
-        with open(JOBS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(jobs, f, ensure_ascii=False, indent=2)
-    except Exception as e:  
-        logger.error(f"Lỗi khi save jobs status: {e}")
+# Import file cũ trước khi registry nạp job, để job dang dở trong file cũng được đánh dấu failed
+import_legacy_jobs()
+job_registry.start()
 
-def generate_job_id():
-    """Tạo job ID duy nhất"""
-    return f"job_{int(time.time() * 1000)}"
+def generate_job_id(prefix="job"):
+    """Tạo job ID duy nhất (không trùng kể cả khi nhiều request trong cùng 1 ms)"""
+    global _last_job_ms
+    with _job_id_lock:
+        ms = max(int(time.time() * 1000), _last_job_ms + 1)
+        _last_job_ms = ms
+    return f"{prefix}_{ms}"
 
-def csv_exists_and_valid():
-    """Kiểm tra CSV file có tồn tại và hợp lệ"""
-    return CSV_PATH.exists() and CSV_PATH.stat().st_size > 0
+def job_dir(job_id):
+    """Thư mục artifact riêng của job"""
+    return DOWNLOAD_DIR / job_id
 
-def delete_old_csv():
-    """Xóa file CSV cũ trước khi chạy search mới"""
+def job_csv_path(job_id):
+    """File CSV của job: ưu tiên file fallback cố định, nếu không có thì lấy file Chrome tải về"""
+    fixed = job_dir(job_id) / scraper.CSV_FILENAME
+    if fixed.exists():
+        return fixed
+    csv_files = sorted(job_dir(job_id).glob("*.csv"))
+    return csv_files[0] if csv_files else fixed
+
+def csv_exists_and_valid(job_id):
+    """Kiểm tra CSV file của job có tồn tại và hợp lệ"""
+    csv_path = job_csv_path(job_id)
+    return csv_path.exists() and csv_path.stat().st_size > 0
+
+def wait_for_job_csv(job_id, timeout=CSV_DOWNLOAD_WAIT):
+    """
+    Chờ CSV của job tải xong: khi popup tự tải file (không bắt được URL) Chrome có thể vẫn đang ghi
+    *.crdownload lúc run_search trả về. True nếu có CSV hoàn chỉnh trước khi hết timeout.
+    """
+    deadline = time.time() + timeout
+    while True:
+        if csv_exists_and_valid(job_id) and not any(job_dir(job_id).glob("*.crdownload")):
+            return True
+        if time.time() >= deadline:
+            return False
+        time.sleep(0.2)
+
+def get_browser_pool():
+    """Khởi tạo (lazy) pool Chrome worker dùng chung cho cả server"""
+    global browser_pool
+    with _browser_pool_lock:
+        if browser_pool is None:
+            recycle = RecyclePolicy(BROWSER_MAX_JOBS, BROWSER_MAX_RSS_MB, BROWSER_MAX_JS_HEAP_MB)
+            if not (BROWSER_MAX_JOBS or recycle.samples_memory):
+                recycle = None
+            # Chrome thay thế chạy song song với Chrome cũ trong lúc khởi động nên cần thêm profile
+            profile_count = BROWSER_POOL_SIZE * (2 if recycle else 1)
+            profiles = ProfilePool(CHROME_PROFILES_DIR, profile_count) if CHROME_PROFILES_DIR else None
+            accounts = AccountPool(ACCOUNTS_DIR, captcha_cooldown=ACCOUNT_CAPTCHA_COOLDOWN) if ACCOUNTS_DIR else None
+            browser_pool = BrowserPool(BROWSER_POOL_SIZE, max_queue=JOB_QUEUE_MAX,
+                                       max_active=MAX_CONCURRENT_SCRAPES, profiles=profiles, accounts=accounts,
+                                       recycle=recycle)
+            browser_pool.start()
+        return browser_pool
+
+def update_job(job_id, **fields):
+    """Cập nhật một số trường của job (trong RAM, flush xuống storage ở thread nền)"""
     try:
-        for f in DOWNLOAD_DIR.glob("*.csv"):
-            f.unlink()
-            logger.info(f"Xóa file CSV cũ: {f.name}")
+        return job_registry.update(job_id, **fields)
     except Exception as e:
-        logger.warning(f"Lỗi khi xóa file CSV cũ: {e}")
+        logger.error(f"[{job_id}] Lỗi khi cập nhật job: {e}")
+        return None
+
+def job_search_key(job):
+    """Key cache của job (keyword chuẩn hóa + sub_ids + số trang / số kết quả)"""
+    return search_key(job.get("keyword"), {k: job.get(k) for k in ("sub_id1", "sub_id2", "sub_id3")},
+                      job.get("max_pages"), job.get("max_results"), job.get("min_commission_rate"))
+
+def result_source_job_id(job_id, job):
+    """Job chứa CSV thật sự (job lấy từ cache trỏ về job gốc)"""
+    return job.get("source_job_id") or job_id
+
+def store_job_results(job_id, results_list):
+    """Serialize 1 lần kết quả đã parse + sort, lưu xuống job store và giữ bản trong RAM. Trả về JSON bytes"""
+    body = json.dumps(results_list, ensure_ascii=False).encode('utf-8')
+    job_store.put_results(job_id, body, len(results_list))
+    job_results.put(job_id, job_id, results_list, body)
+    return body
+
+def get_job_results(source_id):
+    """Kết quả của job dạng {"results": list, "body": JSON bytes}, None nếu job chưa có kết quả"""
+    entry = job_results.get(source_id)
+    if entry is not None:
+        return entry
+    stored = job_store.get_results(source_id)
+    if stored is not None:
+        body = stored[0]
+        results_list = json.loads(body)
+        job_results.put(source_id, source_id, results_list, body)
+        return {"results": results_list, "body": body}
+    # Job cũ chưa có kết quả lưu sẵn: parse CSV 1 lần rồi lưu lại
+    if csv_exists_and_valid(source_id):
+        results_list = read_and_sort_affiliate_links(job_csv_path(source_id))
+        return {"results": results_list, "body": store_job_results(source_id, results_list)}
+    return None
+
+def load_job_results(job_id, job):
+    """Kết quả đã parse + sort của job (lấy từ job gốc nếu job lấy từ cache / gộp)"""
+    entry = get_job_results(result_source_job_id(job_id, job))
+    return entry["results"] if entry else []
+
+def send_job_callback(job_id):
+    """Đưa job vừa kết thúc vào hàng đợi webhook nếu client có truyền callback_url"""
+    job = job_registry.get(job_id)
+    if not job or not job.get("callback_url"):
+        return
+    payload = job_status_payload(job_id, job)
+    if job.get("callback_include_results") and job["status"] == "completed":
+        try:
+            payload["data"] = load_job_results(job_id, job)
+        except Exception as e:
+            logger.warning(f"[{job_id}] Không đọc được kết quả cho webhook: {e}")
+    webhooks.enqueue(job["callback_url"], payload)
+
+def end_job(job_id, **fields):
+    """Chuyển job sang trạng thái kết thúc (completed/failed) và gửi webhook nếu có"""
+    job = update_job(job_id, **fields)
+    send_job_callback(job_id)
+    if job and job.get("batch_id"):
+        finish_batch_if_done(job["batch_id"])
+
+def finish_batch_if_done(batch_id):
+    """
+    Kết thúc batch khi task Chrome của batch đã xong và mọi keyword đã kết thúc,
+    kể cả keyword gộp vào job đang chạy của request khác (job con vẫn đang chờ leader).
+    """
+    with _batch_lock:
+        batch = job_registry.get(batch_id)
+        if batch is None or batch["status"] in TERMINAL_STATUSES or batch.get("task_pending"):
+            return
+        for member_id in batch["job_ids"]:
+            member = job_registry.get(member_id)
+            if member is not None and member["status"] not in TERMINAL_STATUSES:
+                return
+        error = batch.get("task_error")
+        end_job(batch_id, status="failed" if error else "completed",
+                completed_at=datetime.now().isoformat(), error=error)
+
+def record_scrape_timings(job_id, driver):
+    """Lưu thời gian từng bước scraper (thời gian chờ, request bị chặn) của lần search vừa chạy trên driver vào job"""
+    update_job(job_id, wait_times=scraper.pop_wait_report(driver),
+               timings=scraper.durations(scraper.pop_timings(driver)))
+    record_blocked(job_id, scraper.pop_blocked_report(driver))
+
+def record_blocked(job_id, blocked):
+    """Số request bị chặn + số byte ước lượng tiết kiệm được của job"""
+    if blocked is None:
+        return
+    update_job(job_id, blocked=blocked)
+    for kind, count in blocked["by_type"].items():
+        blocked_requests.inc(count, type=kind)
+    blocked_bytes.inc(blocked["bytes_saved"])
+
+def seconds_between(start_iso, end_iso):
+    try:
+        return round((datetime.fromisoformat(end_iso) - datetime.fromisoformat(start_iso)).total_seconds(), 3)
+    except (TypeError, ValueError):
+        return None
+
+def finalize_timings(job, fields, parse_seconds):
+    """Ghép thời gian chờ hàng đợi + các bước scraper + parse + tổng thời gian của job"""
+    timings = {}
+    queue = seconds_between(job.get("created_at"), job.get("started_at"))
+    if queue is not None:
+        timings["queue"] = queue
+    timings.update(job.get("browser_timings") or {})
+    timings.update(job.get("timings") or {})
+    if parse_seconds is not None:
+        timings["parse"] = round(parse_seconds, 3)
+    total = seconds_between(job.get("created_at"), fields["completed_at"])
+    if total is not None:
+        timings["total"] = total
+    return timings
+
+def finish_job(job_id, ok, error=None):
+    """Callback khi browser worker chạy xong job (cập nhật cả các job con đã gộp vào job này)"""
+    job = job_registry.get(job_id)
+    key = job_search_key(job) if job else None
+    parse_seconds = None
+    if ok and wait_for_job_csv(job_id):
+        try:
+            # Parse + sort + serialize đúng 1 lần khi job hoàn thành, /results chỉ còn là lookup
+            csv_path = job_csv_path(job_id)
+            parse_started = time.time()
+            results_list = read_and_sort_affiliate_links(csv_path, job.get("min_commission_rate") if job else None)
+            if job and job.get("max_results"):
+                results_list = results_list[:job["max_results"]]
+            parse_seconds = time.time() - parse_started
+            result_count = len(results_list)
+            csv_bytes.observe(csv_path.stat().st_size)
+            csv_rows.observe(result_count)
+            body = store_job_results(job_id, results_list)
+            if key is not None:
+                result_cache.put(key, job_id, results_list, body)
+        except Exception as e:
+            # Không để job completed mà không có kết quả (mỗi lần /results sẽ parse lại và lỗi 500)
+            ok, error = False, f"Không parse được CSV: {e}"
+    else:
+        ok = False
+    if ok:
+        fields = {"status": "completed", "completed_at": datetime.now().isoformat(), "result_count": result_count}
+        logger.info(f"[{job_id}] Tìm kiếm hoàn thành")
+    else:
+        fields = {"status": "failed", "completed_at": datetime.now().isoformat(),
+                  "error": error or "Không lấy được file CSV"}
+        logger.warning(f"[{job_id}] Tìm kiếm thất bại: {error or 'không có CSV'}")
+    products = load_products(job_dir(job_id)) if CAPTURE_PRODUCTS else None
+    if products is not None:
+        fields["product_count"] = len(products)
+    if job is not None:
+        timings = finalize_timings(job, fields, parse_seconds)
+        try:
+            job_store.put_timings(job_id, timings, fields["completed_at"])
+        except Exception as e:
+            logger.warning(f"[{job_id}] Không lưu được timings: {e}")
+        logger.info(f"[{job_id}] Thời gian các bước: {scraper.format_timings(timings)}")
+        if "total" in timings:
+            job_duration.observe(timings["total"], outcome=fields["status"])
+        end_job(job_id, timings=timings, **fields)
+    else:
+        end_job(job_id, **fields)
+
+    followers = single_flight.complete(key, job_id) if key is not None else []
+    for follower_id in followers:
+        end_job(follower_id, **fields)
+    if followers:
+        logger.info(f"[{job_id}] Cập nhật kết quả cho {len(followers)} job con: {followers}")
+
+def start_job(job_id, browser_timings=None):
+    """
+    Callback khi worker lấy job ra khỏi hàng đợi. browser_timings: thời gian khởi động Chrome / quay về
+    offer của worker trước job này (tính vào timings của job, xem finalize_timings)
+    """
+    fields = {"status": "searching", "started_at": datetime.now().isoformat()}
+    if browser_timings:
+        fields["browser_timings"] = browser_timings
+    job = update_job(job_id, **fields)
+    # Trạng thái job con suy ra từ leader (queued -> searching): đánh thức /events của job con ngay
+    for follower_id in single_flight.followers(job_search_key(job), job_id) if job else []:
+        job_registry.touch(follower_id)
+
+def submit_search_job(job_id, keyword, sub_ids, harvest=None):
+    """
+    Đưa job vào hàng đợi của pool, worker rảnh sẽ chạy search trên Chrome đã đăng nhập sẵn.
+    harvest: {"max_pages", "max_results", "min_commission_rate"} (parse_harvest_fields), rỗng = chỉ trang đầu.
+    Raise QueueFullError nếu hàng đợi đầy. Trả về vị trí trong hàng đợi.
+    """
+    download_dir = str(job_dir(job_id).resolve())
+
+    def task(driver):
+        try:
+            return scraper.run_search(driver, keyword, sub_ids=sub_ids, download_dir=download_dir, **(harvest or {}))
+        finally:
+            record_scrape_timings(job_id, driver)
+
+    return get_browser_pool().submit(job_id, task,
+                                     on_done=lambda ok, error: finish_job(job_id, ok, error),
+                                     on_start=lambda browser_timings: start_job(job_id, browser_timings))
+
+def submit_batch_job(batch_id, batch_jobs, harvest=None):
+    """
+    Đưa cả batch vào pool dưới dạng 1 task: các keyword chạy lần lượt trên cùng 1 Chrome đã đăng nhập
+    (scraper.run_search cho từng keyword: perform_search -> apply_commission_filter -> harvest_links).
+    Với TABS_PER_BROWSER > 1 các keyword chạy xen kẽ trên nhiều tab của cùng Chrome đó
+    (chỉ khi search 1 trang: tab chưa hỗ trợ chuyển trang, batch có harvest chạy lần lượt).
+    batch_jobs: list (job_id, keyword, sub_ids). Raise QueueFullError nếu hàng đợi đầy.
+    """
+    def tabs_task(driver):
+        finished = set()
+
+        def on_tab_done(job_id, ok, error, timings, blocked):
+            finished.add(job_id)
+            update_job(job_id, timings=timings)
+            record_blocked(job_id, blocked)
+            finish_job(job_id, ok, error)
+
+        searches = [(job_id, keyword, sub_ids, str(job_dir(job_id).resolve()))
+                    for job_id, keyword, sub_ids in batch_jobs]
+        try:
+            scraper.run_searches_in_tabs(driver, searches, max_tabs=TABS_PER_BROWSER,
+                                         on_start=start_job, on_done=on_tab_done)
+        except Exception as e:
+            for job_id, _, _ in batch_jobs:
+                if job_id not in finished:
+                    finish_job(job_id, False, f"Batch dừng do lỗi trình duyệt: {e}")
+            raise
+        return True
+
+    def task(driver):
+        for i, (job_id, keyword, sub_ids) in enumerate(batch_jobs):
+            start_job(job_id)
+            try:
+                if i > 0 and not scraper.return_to_offer(driver):
+                    raise RuntimeError("Không quay lại được trang offer")
+                ok = scraper.run_search(driver, keyword, sub_ids=sub_ids,
+                                        download_dir=str(job_dir(job_id).resolve()), **(harvest or {}))
+                record_scrape_timings(job_id, driver)
+            except Exception as e:
+                # Driver có thể đã hỏng: dừng batch, các keyword còn lại failed
+                finish_job(job_id, False, str(e))
+                for rest_id, _, _ in batch_jobs[i + 1:]:
+                    finish_job(rest_id, False, f"Batch dừng do lỗi ở keyword '{keyword}': {e}")
+                raise
+            finish_job(job_id, ok)
+        return True
+
+    def on_done(ok, error):
+        update_job(batch_id, task_pending=False, task_error=None if ok else (error or "Batch lỗi"))
+        finish_batch_if_done(batch_id)
+        logger.info(f"[{batch_id}] Batch kết thúc ({len(batch_jobs)} keyword chạy trên Chrome, {TABS_PER_BROWSER} tab)")
+
+    def on_start(browser_timings):
+        start_job(batch_id)
+        if browser_timings:
+            # khởi động Chrome / quay về offer trước batch được tính cho keyword đầu tiên
+            update_job(batch_jobs[0][0], browser_timings=browser_timings)
+
+    use_tabs = TABS_PER_BROWSER > 1 and not harvest
+    return get_browser_pool().submit(batch_id, tabs_task if use_tabs else task, on_done=on_done,
+                                     on_start=on_start)
+
+def reject_job(job_id, reason):
+    """Đánh dấu job (và các job con đã gộp vào) là failed khi không đưa được vào hàng đợi"""
+    fields = {"status": "failed", "completed_at": datetime.now().isoformat(), "error": reason}
+    end_job(job_id, **fields)
+    job = job_registry.get(job_id)
+    for follower_id in single_flight.complete(job_search_key(job), job_id) if job else []:
+        end_job(follower_id, **fields)
 
 # ============== API ENDPOINTS ==============
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({"status": "ok", "message": "Server is running"}), 200
+    pool_stats = browser_pool.stats() if browser_pool else None
+    return jsonify({"status": "ok", "message": "Server is running", "browser_pool": pool_stats,
+                    "single_flight": single_flight.stats(), "webhooks": webhooks.stats()}), 200
+
+def parse_callback_fields(data):
+    """Lấy callback_url/callback_include_results từ request body. Raise ValueError nếu URL không hợp lệ"""
+    callback_url = (data.get('callback_url') or '').strip()
+    if not callback_url:
+        return {}
+    if not callback_url.startswith(('http://', 'https://')):
+        raise ValueError("callback_url phải bắt đầu bằng http:// hoặc https://")
+    return {
+        "callback_url": callback_url,
+        "callback_include_results": bool(data.get('callback_include_results', False))
+    }
+
+def parse_harvest_fields(data):
+    """
+    Lấy max_pages / max_results / min_commission_rate từ request body (chỉ những field có gửi lên).
+    Raise ValueError nếu max_pages / max_results không phải số nguyên dương hoặc vượt MAX_PAGES_LIMIT,
+    min_commission_rate không phải % trong khoảng 0..100 (nhận 5, 3.5 hoặc "3,5%").
+    """
+    fields = {}
+    limits = {"max_pages": MAX_PAGES_LIMIT, "max_results": MAX_PAGES_LIMIT * scraper.PAGE_SIZE}
+    for name, limit in limits.items():
+        value = data.get(name)
+        if value in (None, ''):
+            continue
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{name} phải là số nguyên")
+        if not 1 <= value <= limit:
+            raise ValueError(f"{name} phải trong khoảng 1..{limit}")
+        fields[name] = value
+    rate = data.get("min_commission_rate")
+    if rate not in (None, ''):
+        try:
+            rate = parse_percent(rate) if isinstance(rate, str) else float(rate)
+        except (TypeError, ValueError):
+            raise ValueError("min_commission_rate phải là số (%)")
+        if not 0 <= rate <= 100:
+            raise ValueError("min_commission_rate phải trong khoảng 0..100")
+        fields["min_commission_rate"] = rate
+    return fields
+
+def prepare_search_job(job_id, keyword, sub_ids, no_cache=False, extra=None):
+    """
+    Tạo job cho 1 keyword (chưa đưa vào pool):
+    - cache hit: job completed ngay từ kết quả đã parse, không chạy Chrome
+    - đã có search giống hệt đang chạy: gắn vào job đó (leader) thay vì mở thêm Chrome
+    - còn lại: job mới ở trạng thái queued, có thư mục artifact riêng downloads/<job_id>/
+    Trả về (mode, job) với mode là "cached", "coalesced" hoặc "new".
+    """
+    base = {
+        "keyword": keyword,
+        "sub_id1": sub_ids.get('sub_id1') or None,
+        "sub_id2": sub_ids.get('sub_id2') or None,
+        "sub_id3": sub_ids.get('sub_id3') or None,
+        "created_at": datetime.now().isoformat(),
+        "completed_at": None,
+        **(extra or {})
+    }
+
+    key = search_key(keyword, sub_ids, base.get("max_pages"), base.get("max_results"),
+                     base.get("min_commission_rate"))
+    cached = None if no_cache else result_cache.get(key)
+    if cached is not None:
+        job = job_registry.create(job_id, {
+            **base,
+            "status": "completed",
+            "completed_at": base["created_at"],
+            "cache_hit": True,
+            "source_job_id": cached["job_id"],
+            "result_count": len(cached["results"])
+        })
+        logger.info(f"[{job_id}] Cache hit (job gốc {cached['job_id']}): keyword='{keyword}'")
+        send_job_callback(job_id)
+        return "cached", job
+
+    follower = {}
+
+    def create_follower(leader_id):
+        # Chạy trong lock của single_flight: record job con có trước khi leader kịp complete()
+        follower["job"] = job_registry.create(job_id, {
+            **base,
+            "status": "searching",
+            "leader_job_id": leader_id,
+            "source_job_id": leader_id
+        })
+
+    leader_id = single_flight.join(key, job_id, on_follow=create_follower)
+    if leader_id is not None:
+        job = follower["job"]
+        logger.info(f"[{job_id}] Gộp vào job đang chạy {leader_id}: keyword='{keyword}'")
+        return "coalesced", job
+
+    job_dir(job_id).mkdir(parents=True, exist_ok=True)
+    job = job_registry.create(job_id, {
+        **base,
+        "status": "queued",
+        "artifact_dir": str(job_dir(job_id))
+    })
+    return "new", job
+
+def queue_full_response(e, **fields):
+    """Response 429 + Retry-After khi hàng đợi đầy"""
+    response = jsonify({
+        "status": "error",
+        "message": str(e),
+        **fields,
+        "retry_after": e.retry_after
+    })
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
 
 @app.route('/search_affiliate', methods=['POST'])
 def search_affiliate():
@@ -89,7 +647,14 @@ def search_affiliate():
         "keyword": "từ khóa tìm kiếm",
         "sub_id1": "giá trị sub_id1 (optional)",
         "sub_id2": "giá trị sub_id2 (optional)",
-        "sub_id3": "giá trị sub_id3 (optional)"
+        "sub_id3": "giá trị sub_id3 (optional)",
+        "no_cache": false (optional, true = bỏ qua cache và chạy lại Chrome),
+        "callback_url": "http://... (optional, server POST kết quả job tới đây khi job kết thúc)",
+        "callback_include_results": false (optional, kèm danh sách link trong webhook),
+        "max_pages": 1 (optional, số trang kết quả lấy link),
+        "max_results": 60 (optional, dừng khi đã chọn đủ số sản phẩm; mặc định max_pages đủ cho số này),
+        "min_commission_rate": 5 (optional, % hoa hồng tối thiểu; ngừng chuyển trang khi gặp sản phẩm thấp hơn,
+                                  không có max_pages / max_results thì duyệt tối đa MAX_PAGES_LIMIT trang)
     }
     """
     try:  
@@ -112,51 +677,62 @@ def search_affiliate():
         sub_id2 = data.get('sub_id2', '').strip()
         sub_id3 = data.get('sub_id3', '').strip()
 
-        # Xóa CSV cũ trước khi search
-        delete_old_csv()
+        sub_ids = {'sub_id1': sub_id1, 'sub_id2': sub_id2, 'sub_id3': sub_id3}
+        no_cache = bool(data.get('no_cache', False))
 
-        # Tạo job ID
+        try:
+            callback_fields = parse_callback_fields(data)
+            harvest = parse_harvest_fields(data)
+        except ValueError as e:
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 400
+
+        # Tạo job ID (artifact của job nằm trong downloads/<job_id>/, không đụng tới job khác)
         job_id = generate_job_id()
-        
-        # Lưu trạng thái job
-        jobs = load_jobs_status()
-        jobs[job_id] = {
-            "status":   "searching",
+        mode, job = prepare_search_job(job_id, keyword, sub_ids, no_cache=no_cache,
+                                       extra={**callback_fields, **harvest})
+        common = {
+            "job_id": job_id,
             "keyword": keyword,
             "sub_id1": sub_id1 if sub_id1 else None,
-            "sub_id2":  sub_id2 if sub_id2 else None,
-            "sub_id3": sub_id3 if sub_id3 else None,
-            "created_at": datetime.now().isoformat(),
-            "completed_at": None
+            "sub_id2": sub_id2 if sub_id2 else None,
+            "sub_id3": sub_id3 if sub_id3 else None
         }
-        save_jobs_status(jobs)
-
-        # Xây dựng command với sub_id parameters
-        cmd = f'python search_shopee_affiliate.py "{keyword}"'
-        
-        if sub_id1:
-            cmd += f' --sub-id1 "{sub_id1}"'
-        if sub_id2:
-            cmd += f' --sub-id2 "{sub_id2}"'
-        if sub_id3:
-            cmd += f' --sub-id3 "{sub_id3}"'
-        
-        logger.info(f"[{job_id}] Chạy lệnh: {cmd}")
-        
-        # Chạy subprocess với nohup/detach để script chạy background
-        if os.name == 'nt':  # Windows
-            subprocess.Popen(cmd, shell=True)
-        else:  # Linux/Mac
-            subprocess.Popen(cmd, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        if mode == "cached":
+            return jsonify({
+                "status": "success",
+                "message": "Kết quả lấy từ cache",
+                "job_status": "completed",
+                "cached": True,
+                **common
+            }), 200
+
+        if mode == "coalesced":
+            return jsonify({
+                "status": "success",
+                "message": "Đã gộp vào tìm kiếm giống hệt đang chạy",
+                "leader_job_id": job["leader_job_id"],
+                "coalesced": True,
+                **common
+            }), 202
+
+        try:
+            queue_position = submit_search_job(job_id, keyword, sub_ids, harvest)
+        except QueueFullError as e:
+            reject_job(job_id, str(e))
+            logger.warning(f"[{job_id}] Từ chối: {e}")
+            return queue_full_response(e, job_id=job_id)
+        logger.info(f"[{job_id}] Đưa vào hàng đợi (vị trí {queue_position}): keyword='{keyword}', sub_ids={sub_ids}")
 
         return jsonify({
             "status": "success",
             "message": "Đã bắt đầu tìm kiếm affiliate link",
-            "job_id": job_id,
-            "keyword": keyword,
-            "sub_id1": sub_id1 if sub_id1 else None,
-            "sub_id2": sub_id2 if sub_id2 else None,
-            "sub_id3": sub_id3 if sub_id3 else None
+            "job_status": "queued",
+            "queue_position": queue_position,
+            **common
         }), 202
 
     except Exception as e:  
@@ -166,11 +742,208 @@ def search_affiliate():
             "message": f"Lỗi server: {str(e)}"
         }), 500
 
+def parse_batch_entries(data):
+    """
+    Chuẩn hóa danh sách keyword của batch thành list (keyword, sub_ids).
+    Mỗi phần tử là chuỗi keyword hoặc {"keyword", "sub_id1", ...}; sub_id riêng ghi đè sub_id dùng chung.
+    Raise ValueError nếu dữ liệu không hợp lệ.
+    """
+    keywords = data.get('keywords')
+    if not isinstance(keywords, list) or not keywords:
+        raise ValueError("Vui lòng cung cấp 'keywords' là danh sách không rỗng")
+    if len(keywords) > BATCH_MAX_KEYWORDS:
+        raise ValueError(f"Tối đa {BATCH_MAX_KEYWORDS} keyword mỗi batch")
+
+    shared = {k: (data.get(k) or '').strip() for k in ('sub_id1', 'sub_id2', 'sub_id3')}
+    entries = []
+    for item in keywords:
+        if isinstance(item, str):
+            item = {'keyword': item}
+        if not isinstance(item, dict) or not (item.get('keyword') or '').strip():
+            raise ValueError(f"Keyword không hợp lệ: {item!r}")
+        sub_ids = {k: (item.get(k) or '').strip() or shared[k] for k in shared}
+        entries.append((item['keyword'].strip(), sub_ids))
+    return entries
+
+@app.route('/search_affiliate/batch', methods=['POST'])
+def search_affiliate_batch():
+    """
+    API tìm kiếm nhiều keyword trong 1 phiên Chrome
+    Request body: {
+        "keywords": ["cầu lông", {"keyword": "bóng rổ", "sub_id1": "riêng"}, ...],
+        "sub_id1": "dùng chung (optional)", "sub_id2": "...", "sub_id3": "...",
+        "no_cache": false, "callback_url": "...", "callback_include_results": false,
+        "max_pages": 1, "max_results": 60, "min_commission_rate": 5 (optional, như /search_affiliate, áp dụng cho mọi keyword)
+    }
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({
+                "status": "error",
+                "message": "Vui lòng cung cấp 'keywords' trong request body"
+            }), 400
+        try:
+            entries = parse_batch_entries(data)
+            callback_fields = parse_callback_fields(data)
+            harvest = parse_harvest_fields(data)
+        except ValueError as e:
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 400
+
+        batch_id = generate_job_id("batch")
+        no_cache = bool(data.get('no_cache', False))
+        job_ids, to_run = [], []
+        for keyword, sub_ids in entries:
+            job_id = generate_job_id()
+            mode, _ = prepare_search_job(job_id, keyword, sub_ids, no_cache=no_cache,
+                                         extra={"batch_id": batch_id, **callback_fields, **harvest})
+            job_ids.append(job_id)
+            if mode == "new":
+                to_run.append((job_id, keyword, sub_ids))
+
+        # Batch chỉ completed khi mọi keyword kết thúc (keyword gộp vào job khác có thể vẫn đang chạy)
+        job_registry.create(batch_id, {
+            "type": "batch",
+            "status": "queued" if to_run else "searching",
+            "keyword": None,
+            "created_at": datetime.now().isoformat(),
+            "completed_at": None,
+            "job_ids": job_ids,
+            "task_pending": bool(to_run)
+        })
+        finish_batch_if_done(batch_id)
+
+        queue_position = None
+        if to_run:
+            try:
+                queue_position = submit_batch_job(batch_id, to_run, harvest)
+            except QueueFullError as e:
+                for job_id, _, _ in to_run:
+                    reject_job(job_id, str(e))
+                end_job(batch_id, status="failed", completed_at=datetime.now().isoformat(), error=str(e))
+                logger.warning(f"[{batch_id}] Từ chối batch: {e}")
+                return queue_full_response(e, batch_id=batch_id)
+
+        logger.info(f"[{batch_id}] Batch {len(job_ids)} keyword, {len(to_run)} keyword cần chạy Chrome")
+        return jsonify({
+            "status": "success",
+            "message": "Đã bắt đầu batch tìm kiếm affiliate link",
+            "batch_id": batch_id,
+            "batch_status": job_registry.get(batch_id)["status"],
+            "queue_position": queue_position,
+            "total": len(job_ids),
+            "to_scrape": len(to_run),
+            "job_ids": job_ids
+        }), 202
+
+    except Exception as e:
+        logger.error(f"Lỗi trong /search_affiliate/batch: {e}")
+        return jsonify({
+            "status": "error",
+            "message": f"Lỗi server: {str(e)}"
+        }), 500
+
+@app.route('/search_affiliate/batch/<batch_id>', methods=['GET'])
+def batch_status(batch_id):
+    """
+    API xem trạng thái từng keyword của batch
+    Query params: include_results=true (optional, kèm danh sách link của keyword đã completed)
+    """
+    try:
+        batch = job_registry.get(batch_id)
+        if batch is None or batch.get("type") != "batch":
+            return jsonify({
+                "status": "error",
+                "message": f"Batch ID '{batch_id}' không tồn tại"
+            }), 404
+
+        include_results = request.args.get('include_results', '').lower() in ('1', 'true', 'yes')
+        jobs, counts = [], {}
+        for job_id in batch["job_ids"]:
+            job = job_registry.get(job_id)
+            if job is None:
+                continue
+            payload = job_status_payload(job_id, job)
+            if include_results and job["status"] == "completed":
+                payload["data"] = load_job_results(job_id, job)
+            counts[payload["job_status"]] = counts.get(payload["job_status"], 0) + 1
+            jobs.append(payload)
+
+        return jsonify({
+            "status": "success",
+            "batch_id": batch_id,
+            "batch_status": batch["status"],
+            "created_at": batch["created_at"],
+            "completed_at": batch.get("completed_at"),
+            "error": batch.get("error"),
+            "total": len(batch["job_ids"]),
+            "counts": counts,
+            "jobs": jobs
+        }), 200
+
+    except Exception as e:
+        logger.error(f"Lỗi trong /search_affiliate/batch/{batch_id}: {e}")
+        return jsonify({
+            "status": "error",
+            "message": f"Lỗi server: {str(e)}"
+        }), 500
+
+def job_status_payload(job_id, job):
+    """Nội dung trạng thái job trả về cho /polling và /events"""
+    payload = {
+        "status": "success",
+        "job_id": job_id,
+        "job_status": job["status"],
+        "keyword": job["keyword"],
+        "sub_id1": job.get("sub_id1"),
+        "sub_id2": job.get("sub_id2"),
+        "sub_id3": job.get("sub_id3"),
+        "max_pages": job.get("max_pages"),
+        "max_results": job.get("max_results"),
+        "min_commission_rate": job.get("min_commission_rate"),
+        "created_at": job["created_at"]
+    }
+
+    # Nếu status đã là completed hoặc failed
+    if job["status"] in TERMINAL_STATUSES:
+        payload.update({
+            "completed_at": job["completed_at"],
+            "cached": job.get("cache_hit", False),
+            "result_count": job.get("result_count"),
+            "error": job.get("error"),
+            "timings": job.get("timings"),
+            "wait_times": job.get("wait_times"),
+            "blocked": job.get("blocked")
+        })
+        return payload
+
+    # Job con đã gộp vào leader thì theo trạng thái chờ của leader
+    queue_job_id = job_id
+    if job.get("leader_job_id"):
+        leader = job_registry.get(job["leader_job_id"])
+        if leader and leader["status"] == "queued":
+            payload["job_status"], queue_job_id = "queued", job["leader_job_id"]
+        payload["leader_job_id"] = job["leader_job_id"]
+
+    if payload["job_status"] == "queued":
+        # Đang chờ worker rảnh
+        queue_position = browser_pool.position(queue_job_id) if browser_pool else None
+        payload["queue_position"] = queue_position
+        payload["message"] = f"Đang chờ trong hàng đợi (vị trí {queue_position}), vui lòng polling lại sau"
+    else:
+        # Vẫn đang search
+        payload["job_status"] = "searching"
+        payload["message"] = "Vẫn đang tìm kiếm, vui lòng polling lại sau"
+    return payload
+
 @app.route('/polling', methods=['GET'])
 def polling():
     """
     API polling để kiểm tra trạng thái search
-    Query params: job_id=xxx
+    Query params: job_id=xxx, wait=N (optional, long-poll: chờ tối đa N giây tới khi job đổi trạng thái)
     """
     try: 
         job_id = request.args.get('job_id')
@@ -180,59 +953,18 @@ def polling():
                 "message": "Vui lòng cung cấp job_id"
             }), 400
 
-        jobs = load_jobs_status()
-        if job_id not in jobs:
+        job = job_registry.get(job_id)
+        if job is None:
             return jsonify({
                 "status": "error",
                 "message": f"Job ID '{job_id}' không tồn tại"
             }), 404
 
-        job = jobs[job_id]
-        
-        # Nếu status đã là completed hoặc failed, trả về luôn
-        if job["status"] in ["completed", "failed"]: 
-            return jsonify({
-                "status": "success",
-                "job_id": job_id,
-                "job_status": job["status"],
-                "keyword": job["keyword"],
-                "sub_id1": job.get("sub_id1"),
-                "sub_id2": job.get("sub_id2"),
-                "sub_id3":  job.get("sub_id3"),
-                "created_at": job["created_at"],
-                "completed_at": job["completed_at"]
-            }), 200
+        wait = min(max(request.args.get('wait', 0, type=float), 0), MAX_POLL_WAIT)
+        if wait and job["status"] not in TERMINAL_STATUSES:
+            job = job_registry.wait_for_status_change(job_id, job["status"], wait) or job
 
-        # Kiểm tra xem CSV đã được tạo chưa
-        if csv_exists_and_valid():
-            job["status"] = "completed"
-            job["completed_at"] = datetime.now().isoformat()
-            save_jobs_status(jobs)
-            logger.info(f"[{job_id}] Tìm kiếm hoàn thành")
-            return jsonify({
-                "status": "success",
-                "job_id": job_id,
-                "job_status":   "completed",
-                "keyword": job["keyword"],
-                "sub_id1": job.get("sub_id1"),
-                "sub_id2": job.get("sub_id2"),
-                "sub_id3": job.get("sub_id3"),
-                "created_at": job["created_at"],
-                "completed_at": job["completed_at"]
-            }), 200
-        else:
-            # Vẫn đang search
-            return jsonify({
-                "status": "success",
-                "job_id":   job_id,
-                "job_status":  "searching",
-                "keyword":  job["keyword"],
-                "sub_id1": job.get("sub_id1"),
-                "sub_id2": job.get("sub_id2"),
-                "sub_id3": job.get("sub_id3"),
-                "created_at": job["created_at"],
-                "message": "Vẫn đang tìm kiếm, vui lòng polling lại sau"
-            }), 200
+        return jsonify(job_status_payload(job_id, job)), 200
 
     except Exception as e: 
         logger.error(f"Lỗi trong /polling:   {e}")
@@ -241,39 +973,143 @@ def polling():
             "message": f"Lỗi server:  {str(e)}"
         }), 500
 
+@app.route('/events', methods=['GET'])
+def job_events():
+    """
+    API Server-Sent Events: đẩy mỗi lần job đổi trạng thái (queued -> searching -> completed/failed)
+    Query params: job_id=xxx
+    """
+    job_id = request.args.get('job_id')
+    if not job_id:
+        return jsonify({
+            "status": "error",
+            "message": "Vui lòng cung cấp job_id"
+        }), 400
+    if job_registry.get(job_id) is None:
+        return jsonify({
+            "status": "error",
+            "message": f"Job ID '{job_id}' không tồn tại"
+        }), 404
+
+    def stream():
+        version = job_registry.version(job_id)
+        job = job_registry.get(job_id)
+        last_status = None
+        while job is not None:
+            payload = job_status_payload(job_id, job)
+            if payload["job_status"] != last_status:
+                last_status = payload["job_status"]
+                yield f"event: status\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+            if job["status"] in TERMINAL_STATUSES:
+                return
+            new_job, new_version = job_registry.wait_for_change(job_id, version, SSE_KEEPALIVE)
+            if new_version == version:
+                yield ": keepalive\n\n"
+            job, version = new_job, new_version
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def project_result(item, fields):
+    """Chỉ giữ lại các trường trong fields (None = giữ nguyên)"""
+    return {k: item[k] for k in fields if k in item} if fields else item
+
+def stream_results(job_id, items, total, next_cursor, fields, fmt):
+    """Generator trả kết quả từng item: NDJSON (mỗi dòng 1 item) hoặc mảng JSON chunked"""
+    if fmt == 'ndjson':
+        for item in items:
+            yield json.dumps(project_result(item, fields), ensure_ascii=False) + "\n"
+        return
+    yield f'{{"count": {total}, "job_id": {json.dumps(job_id)}, "next_cursor": {json.dumps(next_cursor)}, "data": ['
+    for i, item in enumerate(items):
+        yield ("," if i else "") + json.dumps(project_result(item, fields), ensure_ascii=False)
+    yield '], "status": "success"}'
+
 @app.route('/results', methods=['GET'])
 def results():
     """
     API lấy kết quả parse affiliate links
-    Query params: job_id=xxx (optional)
+    Query params:
+        job_id=xxx (optional, mặc định là job completed gần nhất)
+        limit=N, cursor=xxx (optional, phân trang; cursor lấy từ next_cursor của trang trước)
+        fields=link,title (optional, chỉ trả về các trường này)
+        stream=ndjson|json (optional, trả kết quả dạng stream)
     """
     try: 
-        job_id = request.args.get('job_id')
+        job_id = request.args.get('job_id') or job_registry.latest_completed_job_id()
 
-        # Kiểm tra xem CSV có tồn tại không
-        if not csv_exists_and_valid():
+        job = job_registry.get(job_id) if job_id else None
+        if job_id and job is None:
             return jsonify({
                 "status": "error",
-                "message": "Chưa có kết quả. Hãy gọi /search_affiliate trước và poll /polling cho đến khi completed"
+                "message": f"Job ID '{job_id}' không tồn tại"
             }), 404
 
-        # Import và chạy parse function
-        from parse_shopee_affiliate import read_and_sort_affiliate_links
-
         try:
-            results_list = read_and_sort_affiliate_links(CSV_PATH)
-            
-            if job_id:
-                jobs = load_jobs_status()
-                if job_id in jobs:
-                    logger.info(f"[{job_id}] Trả về {len(results_list)} kết quả")
+            # Kết quả đã parse sẵn của job (hoặc job gốc nếu lấy từ cache / gộp)
+            source_id = result_source_job_id(job_id, job) if job else None
+            entry = get_job_results(source_id) if source_id else None
+            if entry is None:
+                return jsonify({
+                    "status": "error",
+                    "message": "Chưa có kết quả. Hãy gọi /search_affiliate trước và poll /polling cho đến khi completed"
+                }), 404
 
-            return jsonify({
-                "status": "success",
-                "count": len(results_list),
-                "data": results_list,
-                "job_id": job_id if job_id else None
-            }), 200
+            limit = request.args.get('limit', type=int)
+            cursor = request.args.get('cursor')
+            fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()]
+            fmt = request.args.get('stream')
+            if fmt and fmt not in ('ndjson', 'json'):
+                return jsonify({
+                    "status": "error",
+                    "message": "stream phải là 'ndjson' hoặc 'json'"
+                }), 400
+            if limit is not None and limit < 1:
+                # limit=0 trả về next_cursor bằng cursor hiện tại, client đi theo next_cursor sẽ lặp mãi
+                return jsonify({
+                    "status": "error",
+                    "message": "limit phải >= 1"
+                }), 400
+
+            if limit is not None or cursor or fields or fmt:
+                # Cursor là offset (dạng chuỗi) trong danh sách kết quả đã sort
+                if cursor and not cursor.isdigit():
+                    return jsonify({
+                        "status": "error",
+                        "message": f"cursor không hợp lệ: '{cursor}'"
+                    }), 400
+                total = len(entry['results'])
+                offset = int(cursor) if cursor else 0
+                end = total if limit is None else offset + limit
+                items = entry['results'][offset:end]
+                next_cursor = str(end) if end < total else None
+                logger.info(f"[{job_id}] Trả về {len(items)}/{total} kết quả (offset {offset})")
+
+                if fmt:
+                    mimetype = 'application/x-ndjson' if fmt == 'ndjson' else 'application/json'
+                    headers = {'X-Total-Count': str(total)}
+                    if next_cursor:
+                        headers['X-Next-Cursor'] = next_cursor
+                    return Response(stream_results(job_id, items, total, next_cursor, fields, fmt),
+                                    mimetype=mimetype, headers=headers), 200
+                return jsonify({
+                    "status": "success",
+                    "count": total,
+                    "returned": len(items),
+                    "data": [project_result(item, fields) for item in items],
+                    "job_id": job_id,
+                    "next_cursor": next_cursor
+                }), 200
+
+            logger.info(f"[{job_id}] Trả về {len(entry['results'])} kết quả")
+            # Ghép trực tiếp JSON bytes đã serialize sẵn, không jsonify lại danh sách
+            body = b''.join([
+                b'{"count": ', str(len(entry['results'])).encode(),
+                b', "data": ', entry['body'],
+                b', "job_id": ', json.dumps(job_id).encode(),
+                b', "status": "success"}'
+            ])
+            return Response(body, mimetype='application/json'), 200
 
         except Exception as parse_error:
             logger.error(f"Lỗi khi parse CSV: {parse_error}")
@@ -289,16 +1125,147 @@ def results():
             "message":  f"Lỗi server:   {str(e)}"
         }), 500
 
+@app.route('/products', methods=['GET'])
+def products():
+    """
+    API lấy sản phẩm bắt được từ network response của trang offer (CAPTURE_PRODUCTS=1)
+    Có dữ liệu ngay khi trang kết quả render xong, không cần chờ CSV (job có thể vẫn đang searching)
+    Query params: job_id=xxx (optional, mặc định là job completed gần nhất)
+    """
+    try:
+        job_id = request.args.get('job_id') or job_registry.latest_completed_job_id()
+        job = job_registry.get(job_id) if job_id else None
+        if job is None:
+            return jsonify({
+                "status": "error",
+                "message": f"Job ID '{job_id}' không tồn tại"
+            }), 404
+
+        items = load_products(job_dir(result_source_job_id(job_id, job)))
+        if items is None:
+            return jsonify({
+                "status": "error",
+                "message": "Chưa bắt được sản phẩm nào (bật CAPTURE_PRODUCTS=1 hoặc chờ trang kết quả tải xong)",
+                "job_status": job.get("status")
+            }), 404
+        return jsonify({
+            "status": "success",
+            "job_id": job_id,
+            "job_status": job.get("status"),
+            "count": len(items),
+            "data": items
+        }), 200
+
+    except Exception as e:
+        logger.error(f"Lỗi trong /products: {e}")
+        return jsonify({
+            "status": "error",
+            "message": f"Lỗi server: {str(e)}"
+        }), 500
+
+def percentile(sorted_values, p):
+    """Percentile (nearest-rank) của list đã sort"""
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[k]
+
+TIMING_GROUPS = {"hour": 13, "day": 10, "month": 7}  # độ dài tiền tố ISO timestamp của mỗi nhóm
+
+@app.route('/timings', methods=['GET'])
+def timings_history():
+    """
+    API lịch sử thời gian từng bước của các job (để phát hiện bước nào chậm đi)
+    Query params:
+        job_id=xxx (optional, chỉ trả về timings của job đó)
+        step=search (optional), since=2026-10-01, until=2026-10-18 (optional, ISO)
+        group=hour|day|month (optional, mặc định day)
+    """
+    try:
+        job_id = request.args.get('job_id')
+        if job_id:
+            job = job_registry.get(job_id)
+            if job is None:
+                return jsonify({
+                    "status": "error",
+                    "message": f"Job ID '{job_id}' không tồn tại"
+                }), 404
+            return jsonify({"status": "success", "job_id": job_id, "timings": job.get("timings")}), 200
+
+        group = request.args.get('group', 'day')
+        if group not in TIMING_GROUPS:
+            return jsonify({
+                "status": "error",
+                "message": "group phải là 'hour', 'day' hoặc 'month'"
+            }), 400
+
+        job_registry.flush()
+        rows = job_store.timing_history(step=request.args.get('step'),
+                                        since=request.args.get('since'),
+                                        until=request.args.get('until'))
+        buckets = {}
+        for _, step, duration, recorded_at in rows:
+            buckets.setdefault((recorded_at[:TIMING_GROUPS[group]], step), []).append(duration)
+
+        data = []
+        for (period, step), values in buckets.items():
+            values.sort()
+            data.append({
+                "period": period,
+                "step": step,
+                "count": len(values),
+                "avg": round(sum(values) / len(values), 3),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "max": values[-1]
+            })
+        return jsonify({"status": "success", "group": group, "count": len(data), "data": data}), 200
+
+    except Exception as e:
+        logger.error(f"Lỗi trong /timings: {e}")
+        return jsonify({
+            "status": "error",
+            "message": f"Lỗi server: {str(e)}"
+        }), 500
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Metrics dạng Prometheus text format (request/latency theo route, job, hàng đợi, captcha, cache, CSV)"""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE), 200
+
+@app.route('/captcha', methods=['GET'])
+def captcha_hits_log():
+    """
+    API các lần gặp captcha (có timestamp) để đối chiếu với lưu lượng request
+    Query params: since=epoch giây (optional)
+    """
+    since = request.args.get('since', type=float)
+    hits = captcha_log.recent(since)
+    per_minute = {}
+    for hit in hits:
+        minute = datetime.fromtimestamp(hit["at"]).strftime("%Y-%m-%dT%H:%M")
+        per_minute[minute] = per_minute.get(minute, 0) + 1
+        hit["at"] = datetime.fromtimestamp(hit["at"]).isoformat()
+    return jsonify({
+        "status": "success",
+        **captcha_log.stats(),
+        "per_minute": per_minute,
+        "recent": hits
+    }), 200
+
 @app.route('/status', methods=['GET'])
 def status_all():
     """
-    API lấy danh sách tất cả jobs
+    API lấy danh sách jobs
+    Query params: status=xxx (optional), limit=N (optional, N job mới nhất)
     """
     try:  
-        jobs = load_jobs_status()
+        status_filter = request.args.get('status')
+        limit = request.args.get('limit', type=int)
+        jobs = job_registry.list_jobs(status=status_filter, limit=limit)
         return jsonify({
             "status": "success",
-            "total_jobs": len(jobs),
+            "total_jobs": job_registry.count(status_filter),
             "jobs": jobs
         }), 200
     except Exception as e:
@@ -308,6 +1275,32 @@ def status_all():
             "message": f"Lỗi server: {str(e)}"
         }), 500
 
+@app.route('/cache', methods=['GET'])
+def cache_stats():
+    """API xem thống kê cache kết quả"""
+    return jsonify({"status": "success", "cache": result_cache.stats()}), 200
+
+@app.route('/cache', methods=['DELETE'])
+def cache_invalidate():
+    """
+    API xóa cache kết quả
+    Request body / query params: keyword (+ sub_id1/2/3, max_pages/max_results/min_commission_rate) để xóa 1 key, bỏ trống để xóa toàn bộ cache
+    """
+    data = request.get_json(silent=True) or request.args
+    keyword = (data.get('keyword') or '').strip()
+    if keyword:
+        try:
+            harvest = parse_harvest_fields(data)
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        key = search_key(keyword, {k: data.get(k) for k in ('sub_id1', 'sub_id2', 'sub_id3')},
+                         harvest.get("max_pages"), harvest.get("max_results"), harvest.get("min_commission_rate"))
+        removed = result_cache.invalidate(key)
+    else:
+        removed = result_cache.invalidate()
+    logger.info(f"Xóa {removed} entry khỏi cache")
+    return jsonify({"status": "success", "removed": removed}), 200
+
 @app.errorhandler(404)
 def not_found(error):
     """Handle 404 errors"""
@@ -331,10 +1324,14 @@ if __name__ == '__main__':
     logger.info("=" * 50)
     logger.info("Shopee Affiliate Scraper Server khởi động")
     logger.info("=" * 50)
-    
-    # Chạy Flask app
+
+    # Khởi động sẵn các Chrome worker để job đầu tiên không phải chờ
+    get_browser_pool()
+
+    # Chạy Flask app (tắt reloader để không khởi động pool Chrome 2 lần)
     app.run(
         host='0.0.0.0',
         port=5000,
-        debug=True
-    )
\ No newline at end of file
+        debug=True,
+        use_reloader=False
+    )
\ No newline at end of file
@@ -0,0 +1,161 @@
+# Memory sampling and recycling policy of the long-lived uc.Chrome instances of the browser pool.
+# Chrome leaks over hours of navigation, so every browser is replaced after max_jobs jobs or once its
+# process tree (browser + renderers + GPU/utility processes) or the JS heap of its page exceeds a budget.
+# Process RSS comes from psutil when it is installed, otherwise from /proc (Linux); the JS heap from
+# CDP Performance.getMetrics of the current tab.
+
+import os
+import time
+
+try:
+    import psutil
+except ImportError:  # optional dependency
+    psutil = None
+
+MB = 1024 * 1024
+
+
+def _proc_children():
+    """{ppid: [pid, ...]} of all processes, read from /proc"""
+    children = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat", "r") as fh:
+                stat = fh.read()
+        except OSError:
+            continue
+        # "pid (comm) state ppid ..." - comm may contain spaces/parentheses
+        fields = stat.rsplit(")", 1)[-1].split()
+        if len(fields) > 1:
+            children.setdefault(int(fields[1]), []).append(int(name))
+    return children
+
+
+def _proc_rss(pid):
+    try:
+        with open(f"/proc/{pid}/status", "r") as fh:
+            for line in fh:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+
+def _proc_cmdline(pid):
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as fh:
+            return fh.read().replace(b"\0", b" ").decode("utf-8", errors="replace")
+    except OSError:
+        return ""
+
+
+def process_tree(pid):
+    """[(pid, rss_bytes, cmdline)] of pid and all its descendants, None when it cannot be read"""
+    if psutil is not None:
+        try:
+            root = psutil.Process(pid)
+            procs = [root] + root.children(recursive=True)
+        except psutil.Error:
+            return None
+        tree = []
+        for p in procs:
+            try:
+                tree.append((p.pid, p.memory_info().rss, " ".join(p.cmdline())))
+            except psutil.Error:
+                continue
+        return tree
+    if not os.path.isdir(f"/proc/{pid}"):
+        return None
+    children = _proc_children()
+    tree, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        tree.append((current, _proc_rss(current), _proc_cmdline(current)))
+        stack.extend(children.get(current, []))
+    return tree
+
+
+def browser_pid(driver):
+    """PID of the Chrome browser process (uc.Chrome), else of chromedriver whose tree contains Chrome"""
+    pid = getattr(driver, "browser_pid", None)
+    if pid:
+        return pid
+    try:
+        return driver.service.process.pid
+    except AttributeError:
+        return None
+
+
+def sample_rss(driver):
+    """{browser, renderer, other, total} RSS bytes of the driver's Chrome processes, None if unavailable"""
+    pid = browser_pid(driver)
+    tree = process_tree(pid) if pid else None
+    if not tree:
+        return None
+    rss = {"browser": 0, "renderer": 0, "other": 0}
+    for _, size, cmdline in tree:
+        if "--type=renderer" in cmdline:
+            rss["renderer"] += size
+        elif "--type=" in cmdline:
+            rss["other"] += size  # gpu-process, utility, zygote...
+        else:
+            rss["browser"] += size  # browser process (and chromedriver)
+    rss["total"] = sum(rss.values())
+    return rss
+
+
+def sample_js_heap(driver):
+    """(used, total) JS heap bytes of the current tab via CDP Performance.getMetrics, None on error"""
+    try:
+        if not getattr(driver, "_performance_enabled", False):
+            driver.execute_cdp_cmd("Performance.enable", {})
+            driver._performance_enabled = True
+        metrics = driver.execute_cdp_cmd("Performance.getMetrics", {}).get("metrics", [])
+    except Exception:
+        return None
+    values = {m.get("name"): m.get("value") for m in metrics}
+    if "JSHeapUsedSize" not in values:
+        return None
+    return values["JSHeapUsedSize"], values.get("JSHeapTotalSize")
+
+
+def sample_memory(driver):
+    """Memory snapshot of one browser in MB: {rss_total, rss_browser, rss_renderer, rss_other, js_heap_used, js_heap_total}"""
+    sample = {}
+    rss = sample_rss(driver)
+    if rss is not None:
+        sample.update({f"rss_{k}": round(v / MB, 1) for k, v in rss.items()})
+    heap = sample_js_heap(driver)
+    if heap is not None:
+        sample["js_heap_used"] = round(heap[0] / MB, 1)
+        if heap[1] is not None:
+            sample["js_heap_total"] = round(heap[1] / MB, 1)
+    sample["at"] = time.time()
+    return sample
+
+
+class RecyclePolicy:
+    """When to replace a browser; a limit of 0 disables that check"""
+
+    def __init__(self, max_jobs=0, max_rss_mb=0, max_js_heap_mb=0):
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self.max_js_heap_mb = max_js_heap_mb
+
+    @property
+    def samples_memory(self):
+        return bool(self.max_rss_mb or self.max_js_heap_mb)
+
+    def reason(self, jobs, sample=None):
+        """'jobs' / 'rss' / 'js_heap' when the browser is due for recycling, else None"""
+        if self.max_jobs and jobs >= self.max_jobs:
+            return "jobs"
+        sample = sample or {}
+        if self.max_rss_mb and sample.get("rss_total", 0) > self.max_rss_mb:
+            return "rss"
+        if self.max_js_heap_mb and sample.get("js_heap_used", 0) > self.max_js_heap_mb:
+            return "js_heap"
+        return None
@@ -0,0 +1,399 @@
+"""
+Pool các worker trình duyệt uc.Chrome sống lâu, đã đăng nhập sẵn bằng cookie.json
+và đỗ sẵn ở OFFER_PATH. Job được dispatch tới worker rảnh thay vì mỗi request
+phải khởi động 1 process Python + 1 Chrome mới.
+Khi có AccountPool, mỗi worker đăng nhập bằng 1 tài khoản còn khỏe và job được
+chia cho worker có tài khoản ít việc nhất gần đây (xem accounts.py).
+"""
+import logging
+import math
+import threading
+import time
+from collections import deque
+
+import browser_lifecycle
+import search_shopee_affiliate as scraper
+from accounts import NoAccountAvailable
+
+logger = logging.getLogger(__name__)
+
+RESTART_DELAY = 5  # giây chờ trước khi thử khởi động lại Chrome bị lỗi
+MAX_ACCOUNT_WAIT = 30  # giây tối đa ngủ 1 lần khi mọi tài khoản đang cooldown
+DEFAULT_JOB_SECONDS = 40  # ước lượng thời gian 1 job khi chưa có số liệu (dùng cho Retry-After)
+
+
+class QueueFullError(Exception):
+    """Hàng đợi job đã đầy, client nên thử lại sau retry_after giây"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Hàng đợi job đã đầy, thử lại sau {retry_after}s")
+        self.retry_after = retry_after
+
+
+class BrowserTask:
+    """1 đơn vị công việc chạy trên driver của worker"""
+
+    def __init__(self, job_id, fn, on_done=None, on_start=None):
+        self.job_id = job_id
+        self.fn = fn              # fn(driver) -> bool
+        self.on_done = on_done    # on_done(ok, error)
+        self.on_start = on_start  # on_start(browser_timings) khi worker bắt đầu chạy task
+
+
+class BrowserWorker(threading.Thread):
+    """Thread sở hữu 1 uc.Chrome, lấy task từ hàng đợi chung của pool"""
+
+    def __init__(self, pool, index):
+        super().__init__(name=f"browser-worker-{index}", daemon=True)
+        self.pool = pool
+        self.index = index
+        self.driver = None
+        self.current_job = None
+        self.jobs_done = 0
+        self.profile = None  # ChromeProfile đang dùng (None = profile trắng tạm thời)
+        self.account = None  # Account đang đăng nhập (None = cookie.json mặc định)
+        # thời gian khởi động Chrome (cookie_load, chrome_launch, ...) / quay về offer chưa tính cho job nào,
+        # được giao cho task kế tiếp qua on_start(browser_timings)
+        self.pending_timings = {}
+        self.browser_jobs = 0  # số job đã chạy trên Chrome hiện tại
+        self.browser_started_at = None
+        self.memory = None  # mẫu bộ nhớ gần nhất của Chrome hiện tại (browser_lifecycle.sample_memory)
+        self._replacement = None  # (thread, kết quả, lý do) khi đang khởi động sẵn Chrome thay thế
+
+    @property
+    def busy(self):
+        return self.current_job is not None
+
+    def _start_browser(self):
+        self._use_browser(*self._open_browser())
+
+    def _open_browser(self):
+        """Khởi động + đăng nhập 1 Chrome mới. Trả về (driver, profile, account, startup_timings)"""
+        accounts = self.pool.accounts
+        account = accounts.acquire() if accounts else None  # NoAccountAvailable nếu mọi tài khoản đang cooldown
+        profile = None
+        if self.pool.profiles:
+            profile = self.pool.profiles.acquire(account.name) if account else self.pool.profiles.acquire()
+        try:
+            driver = scraper.launch_browser(profile)
+        except Exception:
+            self._release(profile, account)
+            raise
+        try:
+            if not scraper.open_session(driver, profile, account.cookie_file if account else None):
+                raise RuntimeError("Không thể đăng nhập / vào trang offer")
+        except Exception as e:
+            if account:
+                # không vào được offer vì captcha -> cooldown captcha, còn lại là lỗi đăng nhập
+                if scraper.pop_captcha_hits(driver):
+                    accounts.report_captcha(account)
+                else:
+                    accounts.report_login(account, False, str(e))
+            self._quit(driver)
+            self._release(profile, account)
+            raise
+        finally:
+            startup_timings = scraper.durations(scraper.pop_timings(driver))
+        scraper.pop_captcha_hits(driver)
+        if account:
+            accounts.report_login(account, True)
+        logger.info(f"[{self.name}] Chrome đã sẵn sàng ở {scraper.OFFER_PATH}"
+                    f"{f' (tài khoản {account.name})' if account else ''} "
+                    f"({scraper.format_timings(startup_timings)})")
+        return driver, profile, account, startup_timings
+
+    def _use_browser(self, driver, profile, account, startup_timings):
+        self.driver = driver
+        self.profile = profile
+        self.account = account
+        self.pending_timings = dict(startup_timings)
+        self.browser_jobs = 0
+        self.browser_started_at = time.time()
+        self.memory = None
+
+    def _stop_browser(self):
+        if self.driver is not None:
+            self._quit(self.driver)
+            self.driver = None
+        self._release(self.profile, self.account)
+        self.profile = None
+        self.account = None
+        self.browser_started_at = None
+
+    def _release(self, profile, account):
+        if profile is not None:
+            self.pool.profiles.release(profile)
+        if account is not None:
+            self.pool.accounts.release(account)
+
+    def _check_captcha(self):
+        """Job vừa chạy gặp captcha -> cho tài khoản nghỉ và bỏ Chrome để đăng nhập lại bằng tài khoản khác"""
+        if self.driver is None or not scraper.pop_captcha_hits(self.driver) or self.account is None:
+            return
+        cooldown = self.pool.accounts.report_captcha(self.account)
+        logger.warning(f"[{self.name}] Tài khoản {self.account.name} gặp captcha, nghỉ {cooldown}s")
+        self._stop_browser()
+
+    def _check_recycle(self):
+        """Sau mỗi job: đo bộ nhớ, tới hạn (số job / RSS / JS heap) thì khởi động sẵn Chrome thay thế"""
+        policy = self.pool.recycle
+        if policy is None or self.driver is None or self._replacement is not None:
+            return
+        if policy.samples_memory:
+            self.memory = browser_lifecycle.sample_memory(self.driver)
+        reason = policy.reason(self.browser_jobs, self.memory)
+        if reason is None:
+            return
+        memory = self.memory or {}
+        logger.info(f"[{self.name}] Recycle Chrome ({reason}: {self.browser_jobs} job, "
+                    f"RSS {memory.get('rss_total')} MB, JS heap {memory.get('js_heap_used')} MB), "
+                    f"khởi động sẵn Chrome thay thế")
+        result = {}
+
+        def warm():
+            try:
+                result["browser"] = self._open_browser()
+            except Exception as e:
+                result["error"] = e
+
+        thread = threading.Thread(target=warm, name=f"{self.name}-warm", daemon=True)
+        self._replacement = (thread, result, reason)
+        thread.start()
+
+    def _swap_replacement(self, wait=0):
+        """Chrome thay thế đã sẵn sàng -> dùng nó và tắt Chrome cũ (Chrome cũ vẫn nhận job trong lúc chờ)"""
+        if self._replacement is None:
+            return
+        thread, result, reason = self._replacement
+        thread.join(wait)
+        if thread.is_alive():
+            return
+        self._replacement = None
+        if "error" in result:
+            # thử lại ở job sau, Chrome cũ vẫn chạy tiếp
+            logger.error(f"[{self.name}] Không khởi động được Chrome thay thế: {result['error']}")
+            return
+        self._stop_browser()
+        self._use_browser(*result["browser"])
+        self.pool._recycled(reason)
+
+    def _discard_replacement(self):
+        if self._replacement is None:
+            return
+        thread, result, _ = self._replacement
+        thread.join()
+        self._replacement = None
+        if "browser" in result:
+            driver, profile, account, _ = result["browser"]
+            self._quit(driver)
+            self._release(profile, account)
+
+    def _sleep(self, seconds):
+        deadline = time.time() + seconds
+        while not self.pool.stopping and time.time() < deadline:
+            time.sleep(min(1, deadline - time.time()))
+
+    @staticmethod
+    def _quit(driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def _park(self):
+        """Đưa driver về lại trang offer, nếu không được thì bỏ driver để khởi động lại"""
+        started = time.time()
+        try:
+            if scraper.return_to_offer(self.driver):
+                self.pending_timings["return_to_offer"] = round(time.time() - started, 3)
+                return
+        except Exception as e:
+            logger.warning(f"[{self.name}] Lỗi khi quay về offer: {e}")
+        self._stop_browser()
+
+    def run(self):
+        while not self.pool.stopping:
+            if self.account is not None and not self.pool.accounts.is_available(self.account):
+                # tài khoản bị cooldown bởi worker khác dùng chung -> đổi tài khoản
+                self._stop_browser()
+            # Chrome cũ đã hỏng trong lúc khởi động Chrome thay thế -> chờ Chrome thay thế thay vì mở thêm
+            self._swap_replacement(wait=1 if self.driver is None else 0)
+            if self.driver is None and self._replacement is not None:
+                continue
+            if self.driver is None:
+                try:
+                    self._start_browser()
+                except NoAccountAvailable as e:
+                    logger.info(f"[{self.name}] Mọi tài khoản đang cooldown, chờ {e.retry_in}s")
+                    self._sleep(min(e.retry_in, MAX_ACCOUNT_WAIT))
+                    continue
+                except Exception as e:
+                    logger.error(f"[{self.name}] Không khởi động được Chrome: {e}")
+                    time.sleep(RESTART_DELAY)
+                    continue
+
+            task = self.pool._take(self, timeout=1)
+            if task is None:
+                continue
+
+            self.current_job = task.job_id
+            account = self.account  # _stop_browser() khi lỗi sẽ bỏ liên kết tài khoản
+            started = time.time()
+            ok, error = False, None
+            browser_timings, self.pending_timings = self.pending_timings, {}
+            try:
+                if task.on_start:
+                    task.on_start(browser_timings)
+                ok = bool(task.fn(self.driver))
+            except Exception as e:
+                error = str(e)
+                logger.error(f"[{task.job_id}] Lỗi trong worker {self.name}: {e}")
+                self._stop_browser()
+            finally:
+                self.current_job = None
+                self.jobs_done += 1
+                self.browser_jobs += 1
+                self.pool._release(time.time() - started)
+                if account is not None:
+                    self.pool.accounts.job_finished(account, ok)
+
+            if task.on_done:
+                try:
+                    task.on_done(ok, error)
+                except Exception as e:
+                    logger.error(f"[{task.job_id}] Lỗi trong callback on_done: {e}")
+
+            self._check_captcha()
+            if self.driver is not None:
+                self._park()
+            self._check_recycle()
+
+        self._discard_replacement()
+        self._stop_browser()
+
+
+class BrowserPool:
+    """
+    Quản lý N BrowserWorker và hàng đợi task dùng chung.
+    Hàng đợi có giới hạn (max_queue) và số job scrape chạy đồng thời bị giới hạn bởi max_active.
+    """
+
+    def __init__(self, size=1, max_queue=20, max_active=None, profiles=None, accounts=None, recycle=None):
+        self.size = max(1, int(size))
+        self.profiles = profiles  # ProfilePool: mỗi worker dùng 1 user-data-dir đã đăng nhập sẵn
+        self.accounts = accounts  # AccountPool: chia job cho nhiều tài khoản
+        self.recycle = recycle  # browser_lifecycle.RecyclePolicy: thay Chrome sau N job / khi vượt ngân sách bộ nhớ
+        self.recycles = {}  # lý do -> số lần đã thay Chrome
+        self.max_queue = max(0, int(max_queue))
+        self.max_active = max(1, min(int(max_active or self.size), self.size))
+        self.pending = deque()
+        self.active = 0
+        self.avg_job_seconds = DEFAULT_JOB_SECONDS
+        self._cond = threading.Condition()
+        self.workers = []
+        self._waiting = set()  # worker đang chờ task trong _take
+        self.stopping = False
+
+    def start(self):
+        for i in range(self.size):
+            worker = BrowserWorker(self, i)
+            worker.start()
+            self.workers.append(worker)
+        logger.info(f"Browser pool khởi động với {self.size} worker")
+
+    def submit(self, job_id, fn, on_done=None, on_start=None):
+        """Đưa task vào hàng đợi, raise QueueFullError nếu hàng đợi đã đầy. Trả về vị trí trong hàng đợi"""
+        with self._cond:
+            if len(self.pending) >= self.max_queue:
+                raise QueueFullError(self._estimate_wait(len(self.pending) + 1))
+            self.pending.append(BrowserTask(job_id, fn, on_done, on_start))
+            # đánh thức mọi worker để worker có tài khoản ít việc nhất nhận task
+            self._cond.notify_all()
+            return len(self.pending)
+
+    def _take(self, worker, timeout):
+        """Worker lấy task kế tiếp khi còn slot chạy đồng thời và tới lượt (None nếu hết timeout)"""
+        with self._cond:
+            deadline = time.time() + timeout
+            self._waiting.add(worker)
+            try:
+                while not self.stopping and (not self.pending or self.active >= self.max_active
+                                             or not self._is_turn(worker)):
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        if self.pending:
+                            self._cond.notify_all()  # nhường lượt cho worker khác
+                        return None
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting.discard(worker)
+            if self.stopping:
+                return None
+            self.active += 1
+            task = self.pending.popleft()
+            if worker.account is not None:
+                self.accounts.job_started(worker.account)
+            if self.pending:
+                self._cond.notify_all()
+            return task
+
+    def _is_turn(self, worker):
+        """
+        Không có AccountPool: worker nào rảnh cũng nhận. Có AccountPool: trong các worker đang chờ,
+        task dành cho worker có tài khoản còn dùng được và ít job nhất gần đây.
+        """
+        if self.accounts is None or worker.account is None:
+            return True
+        if not self.accounts.is_available(worker.account):
+            return False
+        candidates = [w for w in self._waiting
+                      if w.account is not None and self.accounts.is_available(w.account)]
+        return min(candidates, key=lambda w: (self.accounts.load_key(w.account), w.index)) is worker
+
+    def _release(self, duration):
+        with self._cond:
+            self.active -= 1
+            # EWMA thời gian chạy 1 job, dùng để ước lượng Retry-After
+            self.avg_job_seconds = 0.8 * self.avg_job_seconds + 0.2 * duration
+            self._cond.notify_all()
+
+    def _recycled(self, reason):
+        with self._cond:
+            self.recycles[reason] = self.recycles.get(reason, 0) + 1
+
+    def _estimate_wait(self, position):
+        return max(1, math.ceil(self.avg_job_seconds * position / self.max_active))
+
+    def position(self, job_id):
+        """Vị trí (1-based) của job trong hàng đợi, None nếu không còn chờ"""
+        with self._cond:
+            for i, task in enumerate(self.pending, 1):
+                if task.job_id == job_id:
+                    return i
+        return None
+
+    def stop(self):
+        with self._cond:
+            self.stopping = True
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            pending, active = len(self.pending), self.active
+        return {
+            "size": self.size,
+            "ready": sum(1 for w in self.workers if w.driver is not None),
+            "busy": sum(1 for w in self.workers if w.busy),
+            "active": active,
+            "max_active": self.max_active,
+            "pending": pending,
+            "max_queue": self.max_queue,
+            "avg_job_seconds": round(self.avg_job_seconds, 1),
+            "profiles": self.profiles.stats() if self.profiles else None,
+            "accounts": self.accounts.stats() if self.accounts else None,
+            "recycles": dict(self.recycles),
+            "browsers": [{"worker": w.name, "jobs": w.browser_jobs,
+                          "age": round(time.time() - w.browser_started_at) if w.browser_started_at else None,
+                          "memory_mb": w.memory, "warming_replacement": w._replacement is not None}
+                         for w in self.workers],
+        }
@@ -0,0 +1,139 @@
+# Cheap captcha/challenge detection: a small in-page probe checks the URL and specific challenge
+# DOM markers instead of transferring and scanning driver.page_source. An observer script injected
+# with CDP Page.addScriptToEvaluateOnNewDocument re-runs the probe on DOM mutations and flags the
+# page (window.__captchaHit) as soon as a challenge renders, so callers and waits can react early.
+# Every hit is recorded with a timestamp (process-wide) to correlate captchas with request rate, and
+# counted on the driver so the browser pool can put the account that hit it on cooldown.
+
+import threading
+import time
+from collections import deque
+
+# URL fragments of Shopee / third-party challenge pages
+CAPTCHA_URL_MARKERS = ("captcha", "/verify/traffic", "/challenge")
+# DOM markers that only exist on challenge pages / widgets
+CAPTCHA_SELECTORS = (
+    "iframe[src*='recaptcha']",
+    "iframe[src*='hcaptcha']",
+    "iframe[src*='captcha']",
+    ".g-recaptcha",
+    ".h-captcha",
+    "#captcha",
+    "#NEW_CAPTCHA",
+    "[class*='captcha-container']",
+    "[class*='verify-slider']",
+)
+MAX_HITS = 500
+
+PROBE = """
+var urlMarkers = %(urls)s, selectors = %(selectors)s;
+var url = (location.href || '').toLowerCase();
+for (var i = 0; i < urlMarkers.length; i++) {
+    if (url.indexOf(urlMarkers[i]) >= 0) return 'url:' + urlMarkers[i];
+}
+for (var j = 0; j < selectors.length; j++) {
+    try { if (document.querySelector(selectors[j])) return 'dom:' + selectors[j]; } catch (e) {}
+}
+return null;
+"""
+
+OBSERVER = """
+(function () {
+    if (window.__captchaObserver) return;
+    window.__captchaObserver = true;
+    window.__captchaHit = null;
+    function probe() { %(probe)s }
+    var pending = false;
+    function check() {
+        pending = false;
+        if (window.__captchaHit) return;
+        var marker = probe();
+        if (marker) window.__captchaHit = {marker: marker, url: location.href, at: Date.now()};
+    }
+    function schedule() { if (!pending) { pending = true; setTimeout(check, 100); } }
+    function start() {
+        check();
+        new MutationObserver(schedule).observe(document.documentElement || document,
+                                               {childList: true, subtree: true});
+    }
+    if (document.readyState === 'loading') document.addEventListener('DOMContentLoaded', start);
+    else start();
+})();
+"""
+
+
+def _js_list(items):
+    return "[" + ", ".join("'" + s.replace("'", "\\'") + "'" for s in items) + "]"
+
+
+PROBE_SCRIPT = PROBE % {"urls": _js_list(CAPTCHA_URL_MARKERS), "selectors": _js_list(CAPTCHA_SELECTORS)}
+OBSERVER_SCRIPT = OBSERVER % {"probe": PROBE_SCRIPT}
+# JS expression usable as a wait condition (page_waits.wait_for): truthy once the observer flagged a challenge
+CAPTCHA_FLAG = "window.__captchaHit"
+
+
+class CaptchaLog:
+    """Process-wide counters and timestamped hits"""
+
+    def __init__(self, max_hits=MAX_HITS):
+        self._lock = threading.Lock()
+        self.checks = 0
+        self.hits = 0
+        self._recent = deque(maxlen=max_hits)
+
+    def record(self, marker, url=None):
+        with self._lock:
+            self.checks += 1
+            if marker:
+                self.hits += 1
+                self._recent.append({"at": time.time(), "marker": marker, "url": url})
+
+    def recent(self, since=None):
+        with self._lock:
+            return [dict(h) for h in self._recent if since is None or h["at"] >= since]
+
+    def stats(self):
+        with self._lock:
+            return {"checks": self.checks, "hits": self.hits,
+                    "hit_ratio": round(self.hits / self.checks, 4) if self.checks else 0.0}
+
+
+captcha_log = CaptchaLog()
+
+
+def install_captcha_observer(driver):
+    """Inject the observer into every new document of the current tab, and into the current one."""
+    try:
+        driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": OBSERVER_SCRIPT})
+    except Exception:
+        pass
+    try:
+        driver.execute_script(OBSERVER_SCRIPT)
+        return True
+    except Exception:
+        return False
+
+
+def detect_captcha(driver):
+    """
+    Return the matched marker ('url:...' / 'dom:...') when the current page is a challenge, else None.
+    Runs the probe once in the page (a few querySelector calls, no page_source transfer) and records the result.
+    """
+    marker, url = None, None
+    try:
+        marker = driver.execute_script(PROBE_SCRIPT)
+        if marker:
+            url = driver.current_url
+    except Exception:
+        marker = None
+    captcha_log.record(marker, url)
+    if marker:
+        driver._captcha_hits = getattr(driver, "_captcha_hits", 0) + 1
+    return marker
+
+
+def pop_captcha_hits(driver):
+    """Number of captcha pages detected on this driver since the last call"""
+    hits = getattr(driver, "_captcha_hits", 0)
+    driver._captcha_hits = 0
+    return hits
@@ -0,0 +1,96 @@
+# Managed set of persistent Chrome user-data-dir profiles. A profile keeps its cookies and
+# localStorage between runs, so a browser launched on it can go straight to OFFER_PATH; it is
+# re-seeded from cookie.json only when the health check finds it logged out (see open_session
+# in search_shopee_affiliate.py). Chrome locks a user-data-dir, so each profile is leased to
+# one browser at a time.
+
+import json
+import os
+import threading
+import time
+
+META_FILENAME = "profile_meta.json"
+
+
+class ChromeProfile:
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.name = os.path.basename(self.path)
+        os.makedirs(self.path, exist_ok=True)
+        self._meta_path = os.path.join(self.path, META_FILENAME)
+        self.meta = self._load_meta()
+
+    def _load_meta(self):
+        try:
+            with open(self._meta_path, "r", encoding="utf-8") as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_meta(self):
+        tmp = self._meta_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(self.meta, fh)
+        os.replace(tmp, self._meta_path)
+
+    @property
+    def seeded(self):
+        """True when the profile was seeded from cookie.json and has not been found logged out since"""
+        return bool(self.meta.get("seeded_at")) and self.meta.get("healthy", False)
+
+    def mark_seeded(self, ok):
+        now = time.time()
+        self.meta.update({"seeded_at": now if ok else self.meta.get("seeded_at"), "healthy": bool(ok),
+                          "checked_at": now, "seed_count": self.meta.get("seed_count", 0) + 1})
+        self._save_meta()
+
+    def mark_checked(self, healthy):
+        self.meta.update({"healthy": bool(healthy), "checked_at": time.time()})
+        self._save_meta()
+
+    def info(self):
+        return {"name": self.name, "seeded": self.seeded, **self.meta}
+
+
+class ProfilePool:
+    """
+    Leases profiles base_dir/<prefix>_0 .. <prefix>_{count-1} to browsers. The default prefix is
+    "profile"; with an account pool the prefix is the account name, so a profile only ever holds
+    the cookies of one account.
+    """
+
+    def __init__(self, base_dir, count):
+        self.base_dir = os.path.abspath(base_dir)
+        self.count = count
+        self._profiles = {}
+        self._leased = set()
+        self._lock = threading.Lock()
+
+    def _profile(self, name):
+        profile = self._profiles.get(name)
+        if profile is None:
+            profile = self._profiles[name] = ChromeProfile(os.path.join(self.base_dir, name))
+        return profile
+
+    def acquire(self, prefix="profile"):
+        """A free profile (seeded ones first), or None when all are in use"""
+        with self._lock:
+            candidates = [self._profile(f"{prefix}_{i}") for i in range(self.count)]
+            free = [p for p in candidates if p.name not in self._leased]
+            if not free:
+                return None
+            profile = sorted(free, key=lambda p: not p.seeded)[0]
+            self._leased.add(profile.name)
+            return profile
+
+    def release(self, profile):
+        if profile is None:
+            return
+        with self._lock:
+            self._leased.discard(profile.name)
+
+    def stats(self):
+        with self._lock:
+            leased = set(self._leased)
+            profiles = sorted(self._profiles.values(), key=lambda p: p.name)
+        return [dict(p.info(), leased=p.name in leased) for p in profiles]
@@ -0,0 +1,186 @@
+"""
+Registry job trong bộ nhớ (nguồn dữ liệu chính khi server đang chạy).
+/polling đọc thẳng từ dict trong RAM; các thay đổi được đánh dấu dirty và
+1 thread nền ghi dồn (write-behind) xuống JobStore theo batch.
+Mỗi lần job thay đổi, version của job tăng lên và các thread đang chờ
+(long-poll, SSE) được đánh thức qua condition variable.
+"""
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("completed", "failed")
+
+
+class JobRegistry:
+    def __init__(self, store, flush_interval=0.5, max_jobs_in_memory=2000):
+        self.store = store
+        self.flush_interval = flush_interval
+        self.max_jobs_in_memory = max_jobs_in_memory
+        self._jobs = {}
+        self._dirty = set()
+        self._versions = {}  # job_id -> số lần thay đổi kể từ khi server khởi động
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    # ---------- lifecycle ----------
+    def start(self):
+        """Dựng lại registry từ storage và chạy thread flush nền"""
+        if self._thread is not None:
+            return
+        self.load()
+        self._thread = threading.Thread(target=self._flush_loop, name="job-registry-flush", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def load(self):
+        """Nạp các job gần nhất từ storage. Job còn dang dở của lần chạy trước được đánh dấu failed"""
+        recent = self.store.list_jobs(limit=self.max_jobs_in_memory)
+        interrupted = 0
+        with self._lock:
+            for job_id, job in recent.items():
+                if job.get("status") not in TERMINAL_STATUSES:
+                    job["status"] = "failed"
+                    job["completed_at"] = datetime.now().isoformat()
+                    job["error"] = "Server khởi động lại khi job đang chạy"
+                    self._dirty.add(job_id)
+                    interrupted += 1
+                self._jobs[job_id] = job
+        logger.info(f"Job registry nạp {len(recent)} job từ storage ({interrupted} job dang dở -> failed)")
+
+    def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        self.flush()
+
+    # ---------- write-behind ----------
+    def _flush_loop(self):
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Ghi tất cả job dirty xuống storage trong 1 transaction"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return 0
+                batch = [(job_id, dict(self._jobs[job_id])) for job_id in self._dirty if job_id in self._jobs]
+                self._dirty.clear()
+            try:
+                self.store.put_many(batch)
+            except Exception as e:
+                logger.error(f"Lỗi khi flush {len(batch)} job xuống storage: {e}")
+                with self._lock:
+                    self._dirty.update(job_id for job_id, _ in batch)
+                return 0
+            return len(batch)
+
+    def _mark_dirty(self, job_id):
+        self._dirty.add(job_id)
+        self._versions[job_id] = self._versions.get(job_id, 0) + 1
+        self._changed.notify_all()
+        self._evict()
+
+    def _evict(self):
+        """Bỏ bớt job đã kết thúc (và đã flush) khỏi RAM khi vượt giới hạn"""
+        overflow = len(self._jobs) - self.max_jobs_in_memory
+        if overflow <= 0:
+            return
+        for job_id in list(self._jobs):
+            if overflow <= 0:
+                break
+            if job_id not in self._dirty and self._jobs[job_id].get("status") in TERMINAL_STATUSES:
+                del self._jobs[job_id]
+                self._versions.pop(job_id, None)
+                overflow -= 1
+
+    # ---------- API ----------
+    def create(self, job_id, job):
+        with self._lock:
+            self._jobs[job_id] = dict(job)
+            self._mark_dirty(job_id)
+        return dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+        job = self.store.get(job_id)
+        if job is not None:
+            with self._lock:
+                job = self._jobs.setdefault(job_id, job)
+                return dict(job)
+        return None
+
+    def update(self, job_id, **fields):
+        """Cập nhật trường của job trong RAM, trả về bản copy của job (None nếu không tồn tại)"""
+        with self._lock:
+            if self.get(job_id) is None:
+                return None
+            job = self._jobs[job_id]
+            job.update(fields)
+            self._mark_dirty(job_id)
+            return dict(job)
+
+    def touch(self, job_id):
+        """Báo job đã đổi (tăng version, đánh thức /events) khi trạng thái hiển thị của nó phụ thuộc job khác"""
+        with self._lock:
+            if job_id in self._jobs:
+                self._versions[job_id] = self._versions.get(job_id, 0) + 1
+                self._changed.notify_all()
+
+    def version(self, job_id):
+        with self._lock:
+            return self._versions.get(job_id, 0)
+
+    def wait_for_change(self, job_id, since_version, timeout):
+        """
+        Chờ tới khi job có version khác since_version hoặc hết timeout.
+        Trả về (job, version) tại thời điểm trả về.
+        """
+        deadline = time.time() + timeout
+        with self._changed:
+            while self._versions.get(job_id, 0) == since_version:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._changed.wait(remaining)
+            return self.get(job_id), self._versions.get(job_id, 0)
+
+    def wait_for_status_change(self, job_id, status, timeout):
+        """Chờ tới khi status của job khác status hoặc hết timeout, trả về job"""
+        deadline = time.time() + timeout
+        with self._changed:
+            job = self.get(job_id)
+            while job is not None and job.get("status") == status:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._changed.wait(remaining)
+                job = self.get(job_id)
+            return job
+
+    def list_jobs(self, status=None, limit=None):
+        self.flush()
+        return self.store.list_jobs(status=status, limit=limit)
+
+    def count(self, status=None):
+        self.flush()
+        return self.store.count(status)
+
+    def latest_completed_job_id(self):
+        self.flush()
+        return self.store.latest_completed_job_id()
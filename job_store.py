@@ -0,0 +1,185 @@
+"""
+Lưu trạng thái job vào SQLite (WAL) thay cho việc đọc/ghi đè toàn bộ jobs_status.json.
+Mỗi job là 1 row (job_id là primary key), cập nhật 1 job chỉ ghi đúng 1 row.
+Usage (import 1 lần từ file JSON cũ): python job_store.py jobs_status.json
+"""
+import argparse
+import json
+import sqlite3
+import threading
+from pathlib import Path
+
+DEFAULT_DB_PATH = Path("./jobs.db")
+
+# Các trường có cột riêng, những trường còn lại của job nằm trong cột extra (JSON)
+CORE_FIELDS = ("status", "keyword", "sub_id1", "sub_id2", "sub_id3", "created_at", "completed_at")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id       TEXT PRIMARY KEY,
+    status       TEXT NOT NULL,
+    keyword      TEXT,
+    sub_id1      TEXT,
+    sub_id2      TEXT,
+    sub_id3      TEXT,
+    created_at   TEXT,
+    completed_at TEXT,
+    extra        TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status);
+CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs(created_at);
+CREATE TABLE IF NOT EXISTS job_results (
+    job_id  TEXT PRIMARY KEY,
+    count   INTEGER NOT NULL,
+    body    BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_timings (
+    job_id       TEXT NOT NULL,
+    step         TEXT NOT NULL,
+    duration     REAL NOT NULL,
+    recorded_at  TEXT NOT NULL,
+    PRIMARY KEY (job_id, step)
+);
+CREATE INDEX IF NOT EXISTS idx_job_timings_recorded_at ON job_timings(recorded_at);
+"""
+
+INSERT_SQL = f"""
+INSERT INTO jobs (job_id, {", ".join(CORE_FIELDS)}, extra)
+VALUES (?, {", ".join("?" for _ in CORE_FIELDS)}, ?)
+"""
+
+UPSERT_SQL = INSERT_SQL + f"""ON CONFLICT(job_id) DO UPDATE SET
+    {", ".join(f"{c} = excluded.{c}" for c in CORE_FIELDS)},
+    extra = excluded.extra
+"""
+
+
+def _row_to_job(row):
+    job = {field: row[field] for field in CORE_FIELDS}
+    job.update(json.loads(row["extra"] or "{}"))
+    return job
+
+
+def _job_to_params(job_id, job):
+    extra = {k: v for k, v in job.items() if k not in CORE_FIELDS and k != "job_id"}
+    return (job_id, *(job.get(field) for field in CORE_FIELDS), json.dumps(extra, ensure_ascii=False))
+
+
+class JobStore:
+    """Job store nhúng trên SQLite, an toàn khi dùng từ nhiều thread (mỗi thread 1 connection)"""
+
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        self.db_path = str(db_path)
+        self._local = threading.local()
+        conn = self._conn()
+        with conn:
+            conn.executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, job_id):
+        row = self._conn().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return _row_to_job(row) if row else None
+
+    def put_many(self, items):
+        """Ghi nhiều job trong 1 transaction. items: iterable (job_id, job)"""
+        conn = self._conn()
+        with conn:
+            conn.executemany(UPSERT_SQL, [_job_to_params(job_id, job) for job_id, job in items])
+
+    def list_jobs(self, status=None, limit=None):
+        """Danh sách job theo thứ tự created_at (cũ -> mới), dạng {job_id: job}"""
+        sql = "SELECT * FROM jobs"
+        params = []
+        if status:
+            sql += " WHERE status = ?"
+            params.append(status)
+        if limit:
+            sql = f"SELECT * FROM ({sql} ORDER BY created_at DESC LIMIT ?)"
+            params.append(int(limit))
+        sql += " ORDER BY created_at"
+        return {row["job_id"]: _row_to_job(row) for row in self._conn().execute(sql, params)}
+
+    def count(self, status=None):
+        if status:
+            return self._conn().execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()[0]
+        return self._conn().execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def latest_completed_job_id(self):
+        """Job search hoàn thành gần nhất (bỏ qua record batch, batch không có kết quả riêng)"""
+        row = self._conn().execute(
+            "SELECT job_id FROM jobs WHERE status = 'completed' AND json_extract(extra, '$.type') IS NULL "
+            "ORDER BY completed_at DESC LIMIT 1"
+        ).fetchone()
+        return row["job_id"] if row else None
+
+    def put_results(self, job_id, body, count):
+        """Lưu kết quả đã parse của job dưới dạng JSON bytes (mảng data) để /results trả thẳng"""
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO job_results (job_id, count, body) VALUES (?, ?, ?)",
+                (job_id, count, sqlite3.Binary(body)),
+            )
+
+    def get_results(self, job_id):
+        """Trả về (body bytes, count) hoặc None"""
+        row = self._conn().execute("SELECT body, count FROM job_results WHERE job_id = ?", (job_id,)).fetchone()
+        return (bytes(row["body"]), row["count"]) if row else None
+
+    def put_timings(self, job_id, timings, recorded_at):
+        """Lưu thời gian từng bước của job. timings: {step: giây}"""
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO job_timings (job_id, step, duration, recorded_at) VALUES (?, ?, ?, ?)",
+                [(job_id, step, float(duration), recorded_at) for step, duration in timings.items()],
+            )
+
+    def timing_history(self, step=None, since=None, until=None):
+        """Các bản ghi (job_id, step, duration, recorded_at) theo thứ tự thời gian, lọc theo step / khoảng thời gian"""
+        sql = "SELECT job_id, step, duration, recorded_at FROM job_timings WHERE 1 = 1"
+        params = []
+        if step:
+            sql += " AND step = ?"
+            params.append(step)
+        if since:
+            sql += " AND recorded_at >= ?"
+            params.append(since)
+        if until:
+            sql += " AND recorded_at < ?"
+            params.append(until)
+        sql += " ORDER BY recorded_at"
+        return [tuple(row) for row in self._conn().execute(sql, params)]
+
+    def import_json(self, json_path):
+        """Import jobs từ file jobs_status.json cũ, bỏ qua job đã có. Trả về số job được thêm"""
+        with open(json_path, "r", encoding="utf-8") as f:
+            jobs = json.load(f)
+        conn = self._conn()
+        before = self.count()
+        with conn:
+            conn.executemany(
+                INSERT_SQL + "ON CONFLICT(job_id) DO NOTHING",
+                [_job_to_params(job_id, job) for job_id, job in jobs.items()],
+            )
+        return self.count() - before
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import jobs_status.json vào SQLite job store")
+    parser.add_argument("json_path", nargs="?", default="jobs_status.json")
+    parser.add_argument("--db", default=str(DEFAULT_DB_PATH))
+    args = parser.parse_args()
+
+    store = JobStore(args.db)
+    added = store.import_json(args.json_path)
+    print(f"Đã import {added} job từ {args.json_path} vào {args.db} (tổng {store.count()} job)")
@@ -0,0 +1,210 @@
+# Capture the JSON responses the affiliate offer page loads (search, filter, pagination)
+# through Chrome DevTools Protocol network events, and turn them into product records.
+# Requires the driver to be created with performance logging enabled
+# (goog:loggingPrefs = {"performance": "ALL"}, see build_chrome_options in search_shopee_affiliate.py).
+# get_log("performance") consumes the entries, so the log is read in one place (drain_performance_log)
+# and fanned out to every listener registered on the driver (NetworkCapture, resource_blocker.BlockStats).
+
+import base64
+import json
+import os
+
+PRODUCTS_FILENAME = "products.json"
+API_PATH_MARKER = "/api/"
+SHOPEE_PRICE_SCALE = 100000  # Shopee APIs return prices multiplied by 100000
+
+# nested objects some endpoints wrap the item data in
+NESTED_ITEM_KEYS = ("batch_item_for_item_card_full", "item_basic", "item_card", "item", "product")
+ID_KEYS = ("item_id", "itemid", "product_id", "id")
+TITLE_KEYS = ("name", "title", "item_name", "product_name")
+PRICE_KEYS = ("price", "price_min", "item_price", "product_price")
+COMMISSION_KEYS = ("commission_rate", "seller_commission_rate", "default_commission_rate", "commission")
+SHOP_KEYS = ("shop_name", "shopname", "shop")
+LINK_KEYS = ("product_link", "long_link", "offer_link", "link")
+
+
+def _first(d, keys):
+    for k in keys:
+        v = d.get(k)
+        if v not in (None, "", [], {}):
+            return v
+    return None
+
+
+def _to_price(value):
+    try:
+        price = float(value)
+    except (TypeError, ValueError):
+        return None
+    # scaled integer prices ("12300000000" -> 123000.0)
+    if float(price).is_integer() and price >= SHOPEE_PRICE_SCALE:
+        price = price / SHOPEE_PRICE_SCALE
+    return price
+
+
+def _to_percent(value):
+    """'3,3%' / '0.033' / 0.033 / 3.3 -> 3.3"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        s = value.replace(",", ".").strip()
+        if s.endswith("%"):
+            try:
+                return float(s[:-1])
+            except ValueError:
+                return None
+        value = s
+    try:
+        rate = float(value)
+    except (TypeError, ValueError):
+        return None
+    return round(rate * 100, 4) if rate <= 1 else rate
+
+
+def product_record(raw):
+    """Map one item object of the portal API to {id, title, price, commission, shop, link}, or None"""
+    if not isinstance(raw, dict):
+        return None
+    merged = dict(raw)
+    for key in NESTED_ITEM_KEYS:
+        nested = raw.get(key)
+        if isinstance(nested, dict):
+            for k, v in nested.items():
+                merged.setdefault(k, v)
+
+    item_id = _first(merged, ID_KEYS)
+    title = _first(merged, TITLE_KEYS)
+    if item_id is None or not isinstance(title, str):
+        return None
+    shop = _first(merged, SHOP_KEYS)
+    if isinstance(shop, dict):
+        shop = shop.get("name") or shop.get("shop_name")
+    return {
+        "id": str(item_id),
+        "title": title.strip(),
+        "price": _to_price(_first(merged, PRICE_KEYS)),
+        "commission": _to_percent(_first(merged, COMMISSION_KEYS)),
+        "shop": shop,
+        "shop_id": merged.get("shop_id") or merged.get("shopid"),
+        "link": _first(merged, LINK_KEYS),
+    }
+
+
+def extract_products(data):
+    """Walk a decoded JSON response and collect every list entry that looks like a product"""
+    products = []
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            for entry in node:
+                record = product_record(entry)
+                if record is not None:
+                    products.append(record)
+                else:
+                    stack.append(entry)
+    return products
+
+
+def add_performance_listener(driver, listener):
+    """Register listener(webview, method, params) for the CDP events of the driver's performance log"""
+    listeners = getattr(driver, "_perf_listeners", None)
+    if listeners is None:
+        listeners = driver._perf_listeners = []
+    listeners.append(listener)
+
+
+def drain_performance_log(driver):
+    """Consume new performance log entries and dispatch them to the registered listeners"""
+    try:
+        entries = driver.get_log("performance")
+    except Exception:
+        return
+    listeners = getattr(driver, "_perf_listeners", None) or []
+    for entry in entries:
+        try:
+            msg = json.loads(entry["message"])
+        except (KeyError, ValueError):
+            continue
+        message = msg.get("message", {})
+        for listener in listeners:
+            listener(msg.get("webview"), message.get("method"), message.get("params", {}))
+
+
+class NetworkCapture:
+    """
+    Reads the driver's performance log, remembers finished JSON API responses per tab
+    (perf log "webview" == window handle) and fetches their bodies with Network.getResponseBody.
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+        self._responses = {}  # request_id -> (webview, url)
+        self._finished = set()
+        add_performance_listener(driver, self._on_event)
+
+    def _on_event(self, webview, method, params):
+        if method == "Network.responseReceived":
+            response = params.get("response", {})
+            url = response.get("url", "")
+            if API_PATH_MARKER in url and "json" in (response.get("mimeType") or ""):
+                self._responses[params.get("requestId")] = (webview, url)
+        elif method == "Network.loadingFinished":
+            self._finished.add(params.get("requestId"))
+
+    def drain(self):
+        """Consume new performance log entries"""
+        drain_performance_log(self.driver)
+
+    def reset(self):
+        """Drop everything seen so far (e.g. responses of the previous search on this driver)"""
+        self.drain()
+        self._responses.clear()
+        self._finished.clear()
+
+    def collect(self, handle=None):
+        """
+        Fetch bodies of finished API responses (of tab `handle` only, if given; the driver must be
+        switched to that tab) and return the product records found in them as {id: record}.
+        """
+        self.drain()
+        found = {}
+        for request_id in [r for r in self._responses if r in self._finished]:
+            webview, url = self._responses[request_id]
+            if handle is not None and webview not in (None, handle):
+                continue
+            del self._responses[request_id]
+            self._finished.discard(request_id)
+            try:
+                body = self.driver.execute_cdp_cmd("Network.getResponseBody", {"requestId": request_id})
+                text = body.get("body", "")
+                if body.get("base64Encoded"):
+                    text = base64.b64decode(text).decode("utf-8", errors="replace")
+                data = json.loads(text)
+            except Exception:
+                continue
+            for record in extract_products(data):
+                found[record["id"]] = record
+        return found
+
+
+def save_products(download_dir, products):
+    """Write product records to download_dir/PRODUCTS_FILENAME (atomic replace). Returns the path"""
+    os.makedirs(download_dir, exist_ok=True)
+    path = os.path.join(download_dir, PRODUCTS_FILENAME)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(products, fh, ensure_ascii=False)
+    os.replace(tmp, path)
+    return path
+
+
+def load_products(download_dir):
+    """Product records saved for a job, None if nothing was captured"""
+    path = os.path.join(download_dir, PRODUCTS_FILENAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as fh:
+        return json.load(fh)
@@ -0,0 +1,218 @@
+# Event-driven waits for the scraper: instead of fixed time.sleep budgets every wait resolves
+# as soon as its condition holds, using an in-page MutationObserver promise (execute_async_script),
+# document readiness, and a network-idle check (resource timing + in-flight XHR/fetch counter
+# injected with CDP Page.addScriptToEvaluateOnNewDocument).
+# Every wait records how long it actually waited under a step name, per driver (see pop_wait_report).
+
+import threading
+import time
+
+from selenium.common.exceptions import WebDriverException
+
+POLL_INTERVAL = 0.1  # fallback polling when the async script is interrupted (navigation, reload)
+
+# Condition is evaluated immediately, on every DOM mutation and every 50ms (for non-DOM state such as
+# window variables or readyState). `args` is available to the condition expression.
+_ASYNC_CONDITION = """
+var done = arguments[arguments.length - 1];
+var timeoutMs = arguments[0], args = arguments[1];
+function cond() { try { return (__COND__); } catch (e) { return null; } }
+var first = cond();
+if (first) { done(first); return; }
+var finished = false, obs = null, timer = null, iv = null;
+function finish(v) {
+    if (finished) return;
+    finished = true;
+    if (obs) obs.disconnect();
+    clearTimeout(timer); clearInterval(iv);
+    done(v || null);
+}
+function check() { var v = cond(); if (v) finish(v); }
+obs = new MutationObserver(check);
+obs.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+iv = setInterval(check, 50);
+timer = setTimeout(function () { finish(cond()); }, timeoutMs);
+"""
+
+_SYNC_CONDITION = """
+var args = arguments[0];
+try { return (__COND__) || null; } catch (e) { return null; }
+"""
+
+_SELECTOR_MATCH = """(function () {
+    var els = document.querySelectorAll(args.css);
+    for (var i = 0; i < els.length; i++) {
+        if (!args.visible || els[i].getClientRects().length) return true;
+    }
+    return false;
+})()"""
+
+# Resolves once no DOM mutation happened for quietMs.
+_DOM_QUIET = """
+var done = arguments[arguments.length - 1];
+var timeoutMs = arguments[0], quietMs = arguments[1];
+var start = performance.now(), last = start;
+var obs = new MutationObserver(function () { last = performance.now(); });
+obs.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+var iv = setInterval(function () {
+    var now = performance.now();
+    if (now - last >= quietMs || now - start >= timeoutMs) {
+        obs.disconnect(); clearInterval(iv);
+        done(now - last >= quietMs);
+    }
+}, 25);
+"""
+
+# Resolves once no request finished (resource timing) and none is in flight for idleMs.
+_NETWORK_IDLE = """
+var done = arguments[arguments.length - 1];
+var timeoutMs = arguments[0], idleMs = arguments[1];
+var start = performance.now(), last = start;
+var po = null;
+try {
+    po = new PerformanceObserver(function () { last = performance.now(); });
+    po.observe({type: 'resource'});
+} catch (e) {}
+var iv = setInterval(function () {
+    var now = performance.now();
+    if ((window.__pendingRequests || 0) > 0) last = now;
+    if (now - last >= idleMs || now - start >= timeoutMs) {
+        if (po) po.disconnect();
+        clearInterval(iv);
+        done(now - last >= idleMs);
+    }
+}, 25);
+"""
+
+# Counts in-flight XHR/fetch requests of the page (installed before any page script runs).
+REQUEST_TRACKER = """
+(function () {
+    if (window.__pendingRequests !== undefined) return;
+    window.__pendingRequests = 0;
+    function dec() { window.__pendingRequests = Math.max(0, window.__pendingRequests - 1); }
+    var send = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function () {
+        window.__pendingRequests++;
+        this.addEventListener('loadend', dec);
+        return send.apply(this, arguments);
+    };
+    if (window.fetch) {
+        var origFetch = window.fetch;
+        window.fetch = function () {
+            window.__pendingRequests++;
+            return origFetch.apply(this, arguments).then(function (r) { dec(); return r; },
+                                                           function (e) { dec(); throw e; });
+        };
+    }
+})();
+"""
+
+
+class WaitStats:
+    """Time actually spent waiting, per step name"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._steps = {}
+
+    def record(self, step, seconds, ok):
+        with self._lock:
+            s = self._steps.setdefault(step, {"waited": 0.0, "count": 0, "timeouts": 0})
+            s["waited"] += seconds
+            s["count"] += 1
+            if not ok:
+                s["timeouts"] += 1
+
+    def pop(self):
+        """Return {step: {waited, count, timeouts}} and start over"""
+        with self._lock:
+            steps, self._steps = self._steps, {}
+        for s in steps.values():
+            s["waited"] = round(s["waited"], 3)
+        return steps
+
+
+def wait_stats(driver):
+    stats = getattr(driver, "_wait_stats", None)
+    if stats is None:
+        stats = WaitStats()
+        driver._wait_stats = stats
+    return stats
+
+
+def pop_wait_report(driver):
+    """Per-step wait times recorded on this driver since the last call"""
+    return wait_stats(driver).pop()
+
+
+def install_request_tracker(driver):
+    """Inject the in-flight request counter into every new document of the current tab (CDP)."""
+    try:
+        driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": REQUEST_TRACKER})
+        driver.execute_script(REQUEST_TRACKER)
+        return True
+    except Exception:
+        return False
+
+
+def _run_async(driver, script, timeout, *args):
+    """Run an async script with a script timeout just above `timeout`. Raises WebDriverException on failure"""
+    driver.set_script_timeout(timeout + 2)
+    return driver.execute_async_script(script, int(timeout * 1000), *args)
+
+
+def wait_for(driver, cond_js, timeout, step, args=None):
+    """
+    Wait until the JS expression cond_js is truthy (it can use `args`). Returns its value or None on timeout.
+    Falls back to polling when the page navigates while the observer is running.
+    """
+    start = time.time()
+    result = None
+    try:
+        result = _run_async(driver, _ASYNC_CONDITION.replace("__COND__", cond_js), timeout, args or {})
+    except WebDriverException:
+        sync = _SYNC_CONDITION.replace("__COND__", cond_js)
+        while True:
+            try:
+                result = driver.execute_script(sync, args or {})
+            except WebDriverException:
+                result = None
+            if result or time.time() - start >= timeout:
+                break
+            time.sleep(POLL_INTERVAL)
+    wait_stats(driver).record(step, time.time() - start, bool(result))
+    return result
+
+
+def wait_for_selector(driver, css, timeout, step, visible=False):
+    """Wait until an element matching css exists (and is rendered, if visible=True)"""
+    return bool(wait_for(driver, _SELECTOR_MATCH, timeout, step, {"css": css, "visible": visible}))
+
+
+def wait_for_selector_gone(driver, css, timeout, step):
+    """Wait until no rendered element matches css"""
+    return bool(wait_for(driver, "!" + _SELECTOR_MATCH, timeout, step, {"css": css, "visible": True}))
+
+
+def wait_for_document_ready(driver, timeout, step):
+    return bool(wait_for(driver, "document.readyState === 'complete'", timeout, step))
+
+
+def wait_for_dom_quiet(driver, timeout, step, quiet=0.15):
+    """Wait until the DOM stopped changing for `quiet` seconds (e.g. after a click re-renders a list)"""
+    return _wait_fixed_script(driver, _DOM_QUIET, timeout, step, quiet)
+
+
+def wait_for_network_idle(driver, timeout, step, idle=0.3):
+    """Wait until no XHR/fetch is in flight and no resource finished loading for `idle` seconds"""
+    return _wait_fixed_script(driver, _NETWORK_IDLE, timeout, step, idle)
+
+
+def _wait_fixed_script(driver, script, timeout, step, quiet):
+    start = time.time()
+    try:
+        ok = bool(_run_async(driver, script, timeout, int(quiet * 1000)))
+    except WebDriverException:
+        ok = False
+    wait_stats(driver).record(step, time.time() - start, ok)
+    return ok
@@ -19,7 +19,10 @@ def parse_percent(percent_str: str) -> float:
     )
 
 
-def read_and_sort_affiliate_links(csv_path: Path):
+def read_and_sort_affiliate_links(csv_path: Path, min_commission_rate: float = None):
+    """
+    min_commission_rate: bỏ các sản phẩm có % hoa hồng thấp hơn (None = giữ hết)
+    """
     items = []
 
     with csv_path.open(encoding="utf-8-sig", newline="") as f:
@@ -27,6 +30,8 @@ def read_and_sort_affiliate_links(csv_path: Path):
 
         for row in reader:
             commission_rate = parse_percent(row.get("Tỉ lệ hoa hồng"))
+            if min_commission_rate is not None and commission_rate < min_commission_rate:
+                continue
 
             items.append({
                 "title": row.get("Tên sản phẩm", "").strip(),
@@ -0,0 +1,115 @@
+# Block resources the scraper never looks at (product thumbnails, fonts, media, analytics) with
+# CDP Network.setBlockedURLs, so the offer page only loads its documents, scripts, styles and API calls.
+# Blocked requests show up in the performance log as Network.loadingFailed with blockedReason
+# "inspector"; they are counted per tab (webview) with an estimate of the bytes that were not downloaded.
+
+import threading
+
+from network_capture import add_performance_listener, drain_performance_log
+
+# Network.setBlockedURLs patterns ('*' wildcard). SVG is left out on purpose: ant-design icons may load as SVG.
+BLOCK_LISTS = {
+    "image": [
+        "*.jpg", "*.jpeg", "*.png", "*.gif", "*.webp", "*.avif", "*.ico",
+        "*.jpg?*", "*.jpeg?*", "*.png?*", "*.gif?*", "*.webp?*",
+        "*.img.susercontent.com/file/*",  # Shopee product images have no extension
+        "*cf.shopee.vn/file/*",
+    ],
+    "font": ["*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot", "*.woff2?*", "*.woff?*", "*.ttf?*"],
+    "media": ["*.mp4", "*.webm", "*.m3u8", "*.mp3", "*.ogg", "*.wav"],
+    "tracker": [
+        "*google-analytics.com/*", "*googletagmanager.com/*", "*doubleclick.net/*",
+        "*connect.facebook.net/*", "*facebook.com/tr*", "*analytics.tiktok.com/*",
+        "*hotjar.com/*", "*clarity.ms/*", "*googlesyndication.com/*",
+    ],
+}
+DEFAULT_CATEGORIES = ("image", "font", "media", "tracker")
+
+# Rough transfer size of one blocked request, by CDP resource type (used for the "bytes saved" estimate)
+ESTIMATED_BYTES = {
+    "Image": 25_000,
+    "Font": 40_000,
+    "Media": 300_000,
+    "Script": 50_000,
+    "XHR": 2_000,
+    "Fetch": 2_000,
+    "Ping": 500,
+}
+DEFAULT_ESTIMATE = 5_000
+
+
+def block_patterns(categories=DEFAULT_CATEGORIES, extra=()):
+    """URL patterns of the given BLOCK_LISTS categories plus extra patterns, without duplicates"""
+    patterns = []
+    for category in categories:
+        if category not in BLOCK_LISTS:
+            raise ValueError(f"Unknown block category: {category} (known: {', '.join(BLOCK_LISTS)})")
+        patterns.extend(BLOCK_LISTS[category])
+    patterns.extend(extra)
+    return list(dict.fromkeys(patterns))
+
+
+class BlockStats:
+    """Blocked requests and estimated saved bytes per tab"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tabs = {}
+
+    def on_event(self, webview, method, params):
+        if method != "Network.loadingFailed" or params.get("blockedReason") != "inspector":
+            return
+        kind = params.get("type") or "Other"
+        with self._lock:
+            tab = self._tabs.setdefault(webview, {"requests": 0, "bytes_saved": 0, "by_type": {}})
+            tab["requests"] += 1
+            tab["bytes_saved"] += ESTIMATED_BYTES.get(kind, DEFAULT_ESTIMATE)
+            tab["by_type"][kind] = tab["by_type"].get(kind, 0) + 1
+
+    def pop(self, webview=None):
+        """{requests, bytes_saved, by_type} of one tab (or of all tabs when webview is None), then reset it"""
+        with self._lock:
+            if webview is None:
+                tabs, self._tabs = list(self._tabs.values()), {}
+            else:
+                tab = self._tabs.pop(webview, None)
+                tabs = [tab] if tab else []
+        report = {"requests": 0, "bytes_saved": 0, "by_type": {}}
+        for tab in tabs:
+            report["requests"] += tab["requests"]
+            report["bytes_saved"] += tab["bytes_saved"]
+            for kind, n in tab["by_type"].items():
+                report["by_type"][kind] = report["by_type"].get(kind, 0) + n
+        return report
+
+
+def block_stats(driver):
+    stats = getattr(driver, "_block_stats", None)
+    if stats is None:
+        stats = BlockStats()
+        driver._block_stats = stats
+        add_performance_listener(driver, stats.on_event)
+    return stats
+
+
+def install_resource_blocking(driver, patterns):
+    """
+    Block `patterns` in the current tab. Network.setBlockedURLs is per target and needs the Network
+    domain enabled there, so call it (after Network.enable) for every new tab.
+    """
+    if not patterns:
+        return False
+    block_stats(driver)
+    try:
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+        return True
+    except Exception:
+        return False
+
+
+def pop_blocked_report(driver, handle=None):
+    """Blocked requests of this driver (of tab `handle` only, if given) since the last call"""
+    if getattr(driver, "_block_stats", None) is None:
+        return None
+    drain_performance_log(driver)
+    return driver._block_stats.pop(handle)
@@ -0,0 +1,83 @@
+"""
+Cache kết quả search theo (keyword đã chuẩn hóa, sub_id1, sub_id2, sub_id3[, max_pages, max_results]).
+Có TTL và giới hạn số entry (LRU), để keyword lặp lại không phải chạy lại Chrome.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_keyword(keyword):
+    """'  Cầu   LÔNG ' -> 'cầu lông'"""
+    return " ".join((keyword or "").split()).casefold()
+
+
+def search_key(keyword, sub_ids=None, max_pages=None, max_results=None, min_commission_rate=None):
+    """Key dùng chung cho cache và cho việc gộp các search giống nhau (search nhiều trang / lọc hoa hồng là key khác)"""
+    sub_ids = sub_ids or {}
+    key = (
+        normalize_keyword(keyword),
+        (sub_ids.get("sub_id1") or "").strip(),
+        (sub_ids.get("sub_id2") or "").strip(),
+        (sub_ids.get("sub_id3") or "").strip(),
+    )
+    if max_pages or max_results:
+        key += (max_pages or 0, max_results or 0)
+    if min_commission_rate is not None:
+        key += ("min_rate", float(min_commission_rate))
+    return key
+
+
+class ResultCache:
+    def __init__(self, ttl=900, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> {"job_id", "results", "body", "cached_at"}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Trả về entry còn hạn (và đánh dấu vừa dùng), None nếu không có/hết hạn"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry["cached_at"] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, job_id, results, body=None):
+        """results: list đã parse, body: JSON bytes đã serialize sẵn của results (optional)"""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = {"job_id": job_id, "results": results, "body": body, "cached_at": time.time()}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """Xóa 1 key, hoặc toàn bộ cache nếu key=None. Trả về số entry đã xóa"""
+        with self._lock:
+            if key is None:
+                removed = len(self._entries)
+                self._entries.clear()
+                return removed
+            return 1 if self._entries.pop(key, None) is not None else 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            }
@@ -4,7 +4,12 @@
 # USAGE: python login_shopee_affiliate_cookie_json.cleaned.py "từ khóa tìm kiếm"
 # USAGE WITH SUB_IDS: python login_shopee_affiliate_cookie_json.cleaned.py "từ khóa tìm kiếm" --sub-id1 "SportShoes" --sub-id2 "InstagramFeed" --sub-id3 "1212BirthdaySale"
 # python search_shopee_affiliate.py "cầu lông" --sub-id1 "zxc" --sub-id2 "zxc" --sub-id3 "zxc"
+# python search_shopee_affiliate.py "cầu lông" --profile chrome_profiles/profile_0   (reuse a logged-in profile)
+# python search_shopee_affiliate.py "cầu lông" --max-results 60   (harvest several result pages)
+# python search_shopee_affiliate.py "cầu lông" --max-pages 10 --min-commission-rate 5
 
+import csv
+import glob
 import json
 import time
 import os
@@ -13,10 +18,18 @@ from urllib.parse import urlparse
 
 import undetected_chromedriver as uc
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.keys import Keys
 
+from captcha_detector import CAPTCHA_FLAG, detect_captcha, install_captcha_observer, pop_captcha_hits
+from chrome_profiles import ChromeProfile
+from network_capture import NetworkCapture, save_products
+from resource_blocker import (DEFAULT_CATEGORIES as DEFAULT_BLOCK_CATEGORIES, block_patterns,
+                              install_resource_blocking, pop_blocked_report)
+from parse_shopee_affiliate import parse_percent
+from page_waits import (install_request_tracker, pop_wait_report, wait_for, wait_for_document_ready,
+                        wait_for_dom_quiet, wait_for_selector, wait_for_selector_gone)
+from timings import durations, format_timings, pop_timings, step_timer, timed
+
 # ---------------- CONFIG ----------------
 COOKIE_JSON_FILE = "cookie.json"
 TARGET_URL = "https://affiliate.shopee.vn"
@@ -31,6 +44,10 @@ ALTERNATE_PATHS = [
 MAX_OFFER_ATTEMPTS = 6
 DEFAULT_WAIT = 6  # base explicit wait (seconds) - short for speed
 DOWNLOAD_DIR = os.path.abspath("downloads")
+CSV_FILENAME = "shopee_affiliate_links.csv"
+CAPTURE_NETWORK = False  # capture the offer page's JSON API responses into products.json (CDP perf log)
+BLOCK_RESOURCES = DEFAULT_BLOCK_CATEGORIES  # resource_blocker.BLOCK_LISTS categories to block, () = load everything
+EXTRA_BLOCKED_URLS = []  # additional Network.setBlockedURLs patterns, e.g. "*.svg"
 # -----------------------------------------
 
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
@@ -73,7 +90,6 @@ def normalize_domain_for_selenium(domain, default_host):
 
 def try_set_cookie_via_cdp(driver, cookie):
     try:
-        driver.execute_cdp_cmd("Network.enable", {})
         payload = {
             'name': cookie['name'],
             'value': cookie['value'],
@@ -93,17 +109,119 @@ def try_set_cookie_via_cdp(driver, cookie):
         return False
 
 
+def enable_network_capture(driver):
+    """Enable CDP network events with buffers big enough to read search result bodies back."""
+    try:
+        driver.execute_cdp_cmd("Network.enable", {"maxTotalBufferSize": 50_000_000, "maxResourceBufferSize": 10_000_000})
+        return True
+    except Exception:
+        return False
+
+
+def setup_tab_network(driver):
+    """Network domain + resource blocking of the current tab (both are per tab in CDP)."""
+    if CAPTURE_NETWORK or BLOCK_RESOURCES or EXTRA_BLOCKED_URLS:
+        enable_network_capture(driver)
+    install_resource_blocking(driver, block_patterns(BLOCK_RESOURCES, EXTRA_BLOCKED_URLS))
+
+
+def get_network_capture(driver):
+    """One NetworkCapture per driver (created lazily), None when CAPTURE_NETWORK is off."""
+    if not CAPTURE_NETWORK:
+        return None
+    capture = getattr(driver, "_network_capture", None)
+    if capture is None:
+        capture = NetworkCapture(driver)
+        driver._network_capture = capture
+    return capture
+
+
+def capture_products(driver, products, download_dir, handle=None):
+    """Merge newly captured product records into `products` and rewrite products.json of the job."""
+    capture = get_network_capture(driver)
+    if capture is None:
+        return products
+    found = capture.collect(handle)
+    if found or not products:
+        products.update(found)
+        save_products(download_dir or DOWNLOAD_DIR, list(products.values()))
+        print(f"Bắt được {len(found)} sản phẩm từ network (tổng {len(products)})")
+    return products
+
+
+SAME_SITE_CDP = {'no_restriction': 'None', 'none': 'None', 'lax': 'Lax', 'strict': 'Strict'}
+
+
+def normalize_cookies_for_cdp(cookies, default_host):
+    """
+    Convert a Cookie-Editor export into Network.setCookies CookieParams (done once per browser start).
+    hostOnly cookies are bound to their host through `url`, domain cookies keep their leading dot.
+    """
+    params = []
+    for c in cookies:
+        name = c.get('name') or c.get('Name') or c.get('key')
+        value = c.get('value') or c.get('Value') or c.get('val') or c.get('cookie')
+        if not name or value is None:
+            continue
+        domain = c.get('domain', '') or default_host
+        path = c.get('path', '/') or '/'
+        secure = bool(c.get('secure', False))
+        p = {'name': name, 'value': str(value), 'path': path, 'secure': secure,
+             'httpOnly': bool(c.get('httpOnly', False))}
+        if c.get('hostOnly'):
+            p['url'] = f"https://{domain.lstrip('.')}{path}"
+        else:
+            p['domain'] = domain if domain.startswith('.') else '.' + domain
+        same_site = SAME_SITE_CDP.get(str(c.get('sameSite') or '').lower())
+        if same_site and (same_site != 'None' or secure):
+            p['sameSite'] = same_site
+        exp = c.get('expirationDate') or c.get('expires') or c.get('expiry')
+        if exp and not c.get('session'):
+            try:
+                p['expires'] = float(exp)
+            except (TypeError, ValueError):
+                pass
+        params.append(p)
+    return params
+
+
+def set_cookies_bulk(driver, cookie_params):
+    """Install all cookies with a single Network.setCookies call (no page needs to be loaded)."""
+    try:
+        driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        driver.execute_cdp_cmd("Network.setCookies", {"cookies": cookie_params})
+        return True
+    except Exception as e:
+        print(f"Network.setCookies lỗi, dùng cách thêm từng cookie: {e}")
+        return False
+
+
 def add_cookies_to_driver(driver, cookies, target_url):
+    """Fast path: one Network.setCookies before the first navigation; falls back to add_cookie per cookie."""
+    parsed = urlparse(target_url)
+    host = parsed.hostname or 'shopee.vn'
+    cookie_params = normalize_cookies_for_cdp(cookies, host)
+    if cookie_params and set_cookies_bulk(driver, cookie_params):
+        print(f"Added {len(cookie_params)}/{len(cookies)} cookies (Network.setCookies)")
+        driver.get(target_url)
+        return
+    add_cookies_one_by_one(driver, cookies, target_url)
+
+
+def add_cookies_one_by_one(driver, cookies, target_url):
     parsed = urlparse(target_url)
     host = parsed.hostname or 'shopee.vn'
     root = f"{parsed.scheme or 'https'}://{host}"
     driver.get(root)
-    time.sleep(0.5)
     try:
         driver.delete_all_cookies()
     except:
         pass
 
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})  # once, for the per-cookie CDP fallback below
+    except Exception:
+        pass
     added = 0
     for c in cookies:
         try:
@@ -132,10 +250,9 @@ def add_cookies_to_driver(driver, cookies, target_url):
 
     print(f"Added ~{added}/{len(cookies)} cookies")
     driver.get(target_url)
-    time.sleep(1)
     try:
         driver.refresh()
-        time.sleep(0.5)
+        wait_for_document_ready(driver, DEFAULT_WAIT, 'cookies')
     except:
         pass
 
@@ -146,8 +263,9 @@ def import_local_storage(driver, items, target_origin):
     parsed = urlparse(target_origin)
     origin = f"{parsed.scheme}://{parsed.hostname}"
     try:
-        driver.get(origin)
-        time.sleep(0.3)
+        # localStorage is per origin: only load it when the driver is not already there
+        if not (driver.current_url or '').startswith(origin):
+            driver.get(origin)
     except:
         pass
     for it in items:
@@ -163,19 +281,14 @@ def import_local_storage(driver, items, target_origin):
             driver.execute_script(f"window.localStorage.setItem({json.dumps(k)}, {json.dumps(v)});")
         except Exception: 
             continue
-    time.sleep(0.2)
 
 
 def is_captcha_page(driver):
-    try:
-        url = (driver.current_url or '').lower()
-        src = (driver.page_source or '').lower()
-        for k in ['captcha', 'checkcaptcha', 'challenge', 'verify', 'hcaptcha', 'recaptcha']:
-            if k in url or k in src:
-                return True
-        return False
-    except: 
-        return False
+    """URL / challenge DOM marker probe (see captcha_detector), every hit is logged with a timestamp."""
+    marker = detect_captcha(driver)
+    if marker:
+        print(f'Phát hiện captcha ({marker})')
+    return bool(marker)
 
 
 def try_navigate_offer_with_retries(driver, target_origin, offer_path, alternate_paths, max_attempts=3):
@@ -187,40 +300,123 @@ def try_navigate_offer_with_retries(driver, target_origin, offer_path, alternate
     for attempt in range(1, max_attempts + 1):
         try:
             driver.get(offer_url)
-            WebDriverWait(driver, DEFAULT_WAIT).until(lambda d: d.current_url is not None)
-            time.sleep(0.6)
+            # the offer page is usable once its search input rendered; a challenge page resolves the
+            # wait early through the captcha observer flag
+            wait_for(driver, f"document.querySelector(args.css) || {CAPTCHA_FLAG}", DEFAULT_WAIT, 'offer',
+                     {"css": ', '.join(SEARCH_INPUT_SELECTORS)})
         except Exception: 
-            time.sleep(0.5)
+            pass
         if not is_captcha_page(driver):
             print('Reached offer page')
             return True
         try:
             driver.get(alt_urls[attempt % len(alt_urls)])
-            time.sleep(0.6)
             driver.get(offer_url)
-            time.sleep(0.6)
+            wait_for_document_ready(driver, DEFAULT_WAIT, 'offer')
         except Exception:
             pass
     print('Cannot reach offer without captcha')
     return False
 
 
-def perform_search(driver, query):
-    if not query:
-        return False
-    selectors = [
-        'input[placeholder="Tìm kiếm tất cả sản phẩm Shopee"]',
-        'input.ant-input.ant-input-lg[placeholder*="Tìm kiếm"]',
-        'input[type="search"]',
-        'input[role="searchbox"]'
-    ]
-    input_el = None
-    for sel in selectors: 
+SEARCH_INPUT_SELECTORS = [
+    'input[placeholder="Tìm kiếm tất cả sản phẩm Shopee"]',
+    'input.ant-input.ant-input-lg[placeholder*="Tìm kiếm"]',
+    'input[type="search"]',
+    'input[role="searchbox"]'
+]
+COMMISSION_RADIO_SELECTOR = 'input.ant-radio-button-input[value="5"]'
+RESULT_LIST_SELECTOR = '.search-list, .shopee-search-item-result'
+ROW_CHECKBOX_SELECTOR = ', '.join(f'{s.strip()} .ant-checkbox-input' for s in RESULT_LIST_SELECTOR.split(','))
+NEXT_PAGE_SELECTOR = 'li.ant-pagination-next:not(.ant-pagination-disabled), .ant-pagination-next:not([disabled])'
+PAGE_SIZE = 20  # products per result page
+MAX_PAGES = 25  # page cap when only min_commission_rate decides where the harvest stops
+CSV_HEADER = ['Tên sản phẩm', 'Link ưu đãi', 'Tỉ lệ hoa hồng']  # columns the app parses
+BATCH_LINK_MAX_ITEMS = 100  # most products one "Lấy link hàng loạt" request accepts; more are split into parts
+
+# first characters of the rendered result list: changes once the next page replaced the rows
+_LIST_SIGNATURE = "(function (css) { var l = document.querySelector(css); return l ? l.innerText.slice(0, 300) : ''; })"
+_LIST_CHANGED = "(function () { var s = %s(args.css); return s && s !== args.before; })()" % _LIST_SIGNATURE
+# signature taken before a search / filter action; also restarts the network-quiet clock of _LIST_SETTLED
+_LIST_BEFORE = "window.__listQuietSince = 0; return %s(arguments[0]);" % _LIST_SIGNATURE
+# truthy once no XHR/fetch is in flight and the list changed, or once it still looks the same after
+# args.grace ms without requests (one result, no results, list already in commission order)
+_LIST_SETTLED = """(function () {
+    if (window.__pendingRequests > 0) { window.__listQuietSince = 0; return false; }
+    if (%s) return 'changed';
+    var now = Date.now();
+    if (!window.__listQuietSince) window.__listQuietSince = now;
+    return now - window.__listQuietSince >= args.grace ? 'unchanged' : false;
+})()""" % _LIST_CHANGED
+LIST_SETTLE_GRACE = 1.5  # seconds without requests after which an unchanged result list is accepted
+
+# Commission text ("3,3%") of every row of the result list, in row checkbox order (null when not found).
+# A row is the outermost ancestor of its checkbox that contains no other row checkbox.
+_ROW_RATES = r"""
+var list = document.querySelector(arguments[0]);
+if (!list) return [];
+var boxes = list.querySelectorAll('.ant-checkbox-input'), rates = [];
+for (var i = 0; i < boxes.length; i++) {
+    var row = boxes[i];
+    while (row.parentElement && row.parentElement !== list &&
+           row.parentElement.querySelectorAll('.ant-checkbox-input').length === 1) row = row.parentElement;
+    var text = row.innerText || '';
+    var m = text.match(/hoa h[ồo]ng[^0-9%]*([0-9]+(?:[.,][0-9]+)?)\s*%/i) ||
+            text.match(/([0-9]+(?:[.,][0-9]+)?)\s*%(?![\s\S]*%)/);
+    rates.push(m ? m[1] + '%' : null);
+}
+return rates;
+"""
+
+
+def find_search_input(driver):
+    """Return the offer page search input if it is present (non-blocking)."""
+    for sel in SEARCH_INPUT_SELECTORS:
         try:
-            input_el = WebDriverWait(driver, 2).until(EC.element_to_be_clickable((By.CSS_SELECTOR, sel)))
-            break
+            for el in driver.find_elements(By.CSS_SELECTOR, sel):
+                if el.is_displayed() and el.is_enabled():
+                    return el
+        except Exception:
+            continue
+    return None
+
+
+def find_select_all_checkbox(driver):
+    """Return the "select all" checkbox of the batch bar, or None (non-blocking)."""
+    for sel in ('.batch-bar-wrapper #batch-bar .ant-checkbox-input', '.batch-bar-wrapper .ant-checkbox-input'):
+        try:
+            return driver.find_element(By.CSS_SELECTOR, sel)
         except Exception:
             continue
+    return None
+
+
+def result_list_signature(driver):
+    """Signature of the result list to pass to wait_for_list_update, taken right before the action."""
+    try:
+        return driver.execute_script(_LIST_BEFORE, RESULT_LIST_SELECTOR) or ''
+    except Exception:
+        return ''
+
+
+def list_update_args(before):
+    return {"css": RESULT_LIST_SELECTOR, "before": before, "grace": int(LIST_SETTLE_GRACE * 1000)}
+
+
+def wait_for_list_update(driver, before, timeout, step):
+    """
+    Wait until the search / filter response re-rendered the result list: the list, search box,
+    radios and batch bar are all on the offer page before the response arrives, so their presence
+    proves nothing. See _LIST_SETTLED.
+    """
+    return bool(wait_for(driver, _LIST_SETTLED, timeout, step, list_update_args(before)))
+
+
+def perform_search(driver, query):
+    if not query:
+        return False
+    wait_for_selector(driver, ', '.join(SEARCH_INPUT_SELECTORS), 2 * len(SEARCH_INPUT_SELECTORS), 'search_input', visible=True)
+    input_el = find_search_input(driver)
     if not input_el:
         for el in driver.find_elements(By.TAG_NAME, 'input'):
             try:
@@ -238,84 +434,201 @@ def perform_search(driver, query):
         input_el.clear()
     except Exception:
         pass
+    before = result_list_signature(driver)
     input_el.send_keys(query)
     input_el.send_keys(Keys.ENTER)
 
-    try:
-        WebDriverWait(driver, DEFAULT_WAIT).until(lambda d: d.current_url and ('search' in d.current_url or 'offer' in d.current_url))
-    except Exception:
-        time.sleep(0.8)
-    time.sleep(0.6)
+    wait_for_list_update(driver, before, DEFAULT_WAIT, 'search')
     return True
 
 
-def click_commission_and_select_all(driver):
+def apply_commission_filter(driver):
     try:
         try:
-            radio = WebDriverWait(driver, 3).until(EC.element_to_be_clickable((By.CSS_SELECTOR, 'input.ant-radio-button-input[value="5"]')))
+            wait_for_selector(driver, COMMISSION_RADIO_SELECTOR, 3, 'filter')
+            radio = driver.find_element(By.CSS_SELECTOR, COMMISSION_RADIO_SELECTOR)
+            before = result_list_signature(driver)
             driver.execute_script('arguments[0].click();', radio)
         except Exception:
+            before = result_list_signature(driver)
             labels = driver.find_elements(By.CSS_SELECTOR, 'label.ant-radio-button-wrapper')
             for lbl in labels:
                 if 'hoa hồng' in (lbl.text or '').lower():
                     driver.execute_script('arguments[0].click();', lbl)
                     break
-        time.sleep(0.6)
+        wait_for_list_update(driver, before, DEFAULT_WAIT, 'filter')
     except Exception:
         return False
 
-    try:
-        WebDriverWait(driver, 4).until(EC.presence_of_element_located((By.CSS_SELECTOR, '.batch-bar-wrapper, .search-list, .shopee-search-item-result')))
-    except Exception:
-        time.sleep(0.6)
+    wait_for_selector(driver, '.batch-bar-wrapper .ant-checkbox-input', 4, 'filter')
+    return True
+
 
+def click_select_all(driver):
     try:
-        checkbox = None
-        try:
-            checkbox = driver.find_element(By.CSS_SELECTOR, '.batch-bar-wrapper #batch-bar .ant-checkbox-input')
-        except Exception:
-            try:
-                checkbox = driver.find_element(By.CSS_SELECTOR, '.batch-bar-wrapper .ant-checkbox-input')
-            except Exception:
-                checkbox = None
+        checkbox = find_select_all_checkbox(driver)
         if checkbox: 
             driver.execute_script('arguments[0].click();', checkbox)
-            time.sleep(0.5)
+            wait_for_dom_quiet(driver, 2, 'select')
             return True
         return False
     except Exception:
         return False
 
 
-def select_all_on_multiple_pages(driver, start_page=2, end_page=5):
-    for page in range(start_page, end_page + 1):
+def select_on_page(driver, wanted):
+    """
+    Select up to `wanted` products of the current result page: the batch bar "select all" when the
+    whole page is wanted, otherwise only the first `wanted` row checkboxes. Returns how many were selected.
+    """
+    rows = [cb for cb in driver.find_elements(By.CSS_SELECTOR, ROW_CHECKBOX_SELECTOR)
+            if not cb.is_selected()]
+    if rows and wanted < len(rows):
+        for cb in rows[:wanted]:
+            driver.execute_script('arguments[0].click();', cb)
+        wait_for_dom_quiet(driver, 2, 'select')
+        return wanted
+    if not click_select_all(driver):
+        return 0
+    return len(rows) or PAGE_SIZE
+
+
+def visible_row_rates(driver):
+    """Commission rate (%) of each row of the current result page, None where it could not be read"""
+    try:
+        texts = driver.execute_script(_ROW_RATES, RESULT_LIST_SELECTOR) or []
+    except Exception:
+        return []
+    rates = []
+    for text in texts:
         try:
-            btn = WebDriverWait(driver, 4).until(
-                EC.element_to_be_clickable((By.XPATH, f"//span[contains(@class,'page-item') and normalize-space()='{page}']"))
-            )
-            driver.execute_script('arguments[0].click();', btn)
-            time.sleep(0.8)
-        except Exception:
-            continue
+            rates.append(parse_percent(text) if text else None)
+        except ValueError:
+            rates.append(None)
+    return rates
+
+
+def rows_above_threshold(rates, min_rate):
+    """Number of leading rows whose rate is >= min_rate (results are sorted by commission; unreadable rows count)"""
+    for i, rate in enumerate(rates):
+        if rate is not None and rate < min_rate:
+            return i
+    return len(rates)
+
+
+def goto_next_page(driver, page):
+    """Open result page `page` (page number or "next" button) and wait until the list shows other rows."""
+    before = driver.execute_script(f"return {_LIST_SIGNATURE}(arguments[0]);", RESULT_LIST_SELECTOR) or ''
+    buttons = driver.find_elements(By.XPATH, f"//span[contains(@class,'page-item') and normalize-space()='{page}']")
+    buttons = buttons or driver.find_elements(By.CSS_SELECTOR, NEXT_PAGE_SELECTOR)
+    if not buttons:
+        return False  # last page
+    try:
+        driver.execute_script('arguments[0].click();', buttons[0])
+    except Exception:
+        return False
+    return bool(wait_for(driver, _LIST_CHANGED, DEFAULT_WAIT, 'paginate', {"css": RESULT_LIST_SELECTOR, "before": before}))
 
-        try:
-            WebDriverWait(driver, 3).until(EC.presence_of_element_located((By.CSS_SELECTOR, '.search-list, .shopee-search-item-result')))
-        except Exception: 
-            time.sleep(0.5)
-        try:
-            cb = None
-            try:
-                cb = driver.find_element(By.CSS_SELECTOR, '.batch-bar-wrapper #batch-bar .ant-checkbox-input')
-            except Exception:
-                try:
-                    cb = driver.find_element(By.CSS_SELECTOR, '.batch-bar-wrapper .ant-checkbox-input')
-                except Exception:
-                    cb = None
-            if cb: 
-                driver.execute_script('arguments[0].click();', cb)
-                time.sleep(0.4)
-        except Exception:
-            continue
+
+def harvest_links(driver, sub_ids=None, download_dir=None, max_pages=None, max_results=None,
+                  min_commission_rate=None, products=None):
+    """
+    On a filtered result list: select products page by page until max_results (or max_pages pages) and
+    generate their links with as few batch-link round trips as BATCH_LINK_MAX_ITEMS allows.
+    max_pages defaults to 1, or to the pages needed for max_results.
+    With min_commission_rate (%), rows are selected only while their visible rate reaches it; the list is
+    sorted by commission, so the first row below it ends the harvest (up to MAX_PAGES pages by default).
+    Every round trip saves one CSV part; parts are merged into CSV_FILENAME.
+    Returns the number of products linked (0 when no row reached min_commission_rate), None on failure.
+    """
+    download_dir = download_dir or DOWNLOAD_DIR
+    if not max_pages:
+        if max_results:
+            max_pages = -(-max_results // PAGE_SIZE)
+        else:
+            max_pages = MAX_PAGES if min_commission_rate is not None else 1
+    target = max_results or max_pages * PAGE_SIZE
+    total = pending = parts = 0
+    page = 1
+    below_threshold = False
+    while True:
+        wanted = target - total
+        if min_commission_rate is not None:
+            rates = visible_row_rates(driver)
+            passing = rows_above_threshold(rates, min_commission_rate)
+            if passing < len(rates):
+                below_threshold = True
+                wanted = min(wanted, passing)
+                print(f'Trang {page}: {passing}/{len(rates)} sản phẩm đạt hoa hồng >= {min_commission_rate}%')
+        selected = 0
+        if wanted > 0:
+            with timed(driver, 'select_all') as span:
+                selected = select_on_page(driver, wanted)
+                span['ok'] = selected > 0
+        if not selected:
+            break
+        total += selected
+        pending += selected
+        if products is not None:
+            capture_products(driver, products, download_dir)
+        if below_threshold or total >= target or page >= max_pages:
+            break
+        if pending + PAGE_SIZE > BATCH_LINK_MAX_ITEMS:
+            # the next page would not fit into this batch-link request: link the selection so far
+            if not click_get_batch_links(driver, sub_ids=sub_ids, download_dir=download_dir, part=parts):
+                return None
+            parts, pending = parts + 1, 0
+        with timed(driver, 'paginate') as span:
+            span['ok'] = goto_next_page(driver, page + 1)
+        if not span['ok']:
+            break
+        page += 1
+    if pending:
+        if not click_get_batch_links(driver, sub_ids=sub_ids, download_dir=download_dir, part=parts):
+            return None
+        parts += 1
+    if not parts:
+        if not below_threshold:
+            return None
+        # nothing reached the threshold: an empty result, not a failure
+        write_empty_csv(download_dir)
+        return 0
+    if parts > 1:
+        merge_csv_parts(download_dir)
+    print(f'Đã chọn {total} sản phẩm trên {page} trang, lấy link bằng {parts} lần')
+    return total
+
+
+def write_empty_csv(download_dir):
+    os.makedirs(download_dir, exist_ok=True)
+    with open(os.path.join(download_dir, CSV_FILENAME), 'w', encoding='utf-8', newline='') as fh:
+        csv.writer(fh).writerow(CSV_HEADER)
+
+
+def merge_csv_parts(download_dir):
+    """Merge every CSV of download_dir (one per batch-link round trip) into CSV_FILENAME, dropping duplicate rows."""
+    paths = sorted(glob.glob(os.path.join(download_dir, '*.csv')), key=os.path.getmtime)
+    header, rows, seen = None, [], set()
+    for path in paths:
+        with open(path, encoding='utf-8-sig', newline='') as fh:
+            reader = csv.reader(fh)
+            part_header = next(reader, None)
+            header = header or part_header
+            for row in reader:
+                if tuple(row) not in seen:
+                    seen.add(tuple(row))
+                    rows.append(row)
+    target_path = os.path.join(download_dir, CSV_FILENAME)
+    tmp = target_path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8', newline='') as fh:
+        writer = csv.writer(fh)
+        if header:
+            writer.writerow(header)
+        writer.writerows(rows)
+    for path in paths:
+        os.remove(path)
+    os.replace(tmp, target_path)
+    return target_path
 
 
 # --- robust click helper used by batch link flow ---
@@ -409,7 +722,6 @@ def fill_sub_ids(driver, modal, sub_ids):
             input_field.send_keys(value)
             filled_count += 1
             print(f"Filled {key}:  {value}")
-            time.sleep(0.2)
         except Exception as e: 
             print(f"Không thể điền {key}: {e}")
             continue
@@ -419,11 +731,18 @@ def fill_sub_ids(driver, modal, sub_ids):
     return True
 
 
-def click_get_batch_links(driver, sub_ids=None):
-    """
-    Click "Lấy link hàng loạt", wait for modal, fill Sub_id fields, click inner "Lấy link" and fallback-download CSV if popup blocked.
-    """
-    # inject override to capture window.open calls (fallback to download via requests when popup blocked)
+def set_download_dir(driver, download_dir):
+    """Point native Chrome downloads of this driver at download_dir (per job when the browser is shared)."""
+    os.makedirs(download_dir, exist_ok=True)
+    try:
+        driver.execute_cdp_cmd("Page.setDownloadBehavior", {"behavior": "allow", "downloadPath": os.path.abspath(download_dir)})
+        return True
+    except Exception:
+        return False
+
+
+def install_window_open_capture(driver):
+    """Override window.open in the current tab to capture the CSV URL (fallback download when the popup is blocked)."""
     try:
         driver.execute_script("""
             window._last_opened_url = null;
@@ -440,19 +759,28 @@ def click_get_batch_links(driver, sub_ids=None):
     except Exception: 
         pass
 
-    # try to find and click main trigger
-    def try_click_candidate(elem):
+
+def read_last_opened_url(driver):
+    try:
+        return driver.execute_script("return window._last_opened_url || null;")
+    except Exception:
+        return None
+
+
+def try_click_candidate(driver, elem):
+    try:
+        driver.execute_script('arguments[0].scrollIntoView({block:"center"});', elem)
+        return robust_click(driver, elem, timeout=1.0)
+    except Exception:
         try:
-            driver.execute_script('arguments[0].scrollIntoView({block:"center"});', elem)
-            time.sleep(0.12)
-            return robust_click(driver, elem, timeout=1.0)
-        except Exception:
-            try:
-                elem.click()
-                return True
-            except:
-                return False
+            elem.click()
+            return True
+        except:
+            return False
+
 
+def find_batch_link_buttons(driver):
+    """Candidates for the main "Lấy link hàng loạt" button (non-blocking)."""
     candidates = []
     try:
         candidates = driver.find_elements(By.XPATH, "//button[.//span[normalize-space()='Lấy link hàng loạt']]")
@@ -482,50 +810,28 @@ def click_get_batch_links(driver, sub_ids=None):
                     continue
         except Exception:
             pass
+    return candidates
 
-    clicked_main = False
-    for cand in candidates:
-        if try_click_candidate(cand):
-            clicked_main = True
-            time.sleep(0.25)
-            break
-
-    if not clicked_main: 
-        print('Không tìm/không click được nút Lấy link hàng loạt')
-        return False
 
-    # wait for modal
+def find_visible_modal(driver):
+    """Return the visible batch link modal body, or None (non-blocking)."""
     try:
-        WebDriverWait(driver, 8).until(
-            EC.visibility_of_element_located((By.XPATH, "//div[contains(@class,'ant-modal-body')]//h4[normalize-space()='Link Hoa hồng Sản phẩm']"))
-        )
-        time.sleep(0.2)
+        for el in driver.find_elements(By.CSS_SELECTOR, '.ant-modal-body'):
+            if el.is_displayed():
+                return el
     except Exception:
-        try:
-            WebDriverWait(driver, 5).until(EC.visibility_of_element_located((By.CSS_SELECTOR, '.ant-modal-body')))
-            time.sleep(0.2)
-        except Exception:
-            print('Modal không hiển thị sau khi click Lấy link hàng loạt')
-            return False
-
-    try:
-        modal = driver.find_element(By.CSS_SELECTOR, '.ant-modal-body')
-    except Exception:
-        print('Không tìm thấy modal sau khi mở.')
-        return False
+        pass
+    return None
 
-    # Fill Sub_id fields if provided
-    if sub_ids: 
-        fill_sub_ids(driver, modal, sub_ids)
-        time.sleep(0.3)
 
+def click_modal_get_link(driver, modal):
+    """Click the inner "Lấy link" button of the batch link modal."""
     inner_selectors = [
         "//div[contains(@class,'ant-modal-body')]//button[.//span[normalize-space()='Lấy link']]",
         ".//button[contains(@class,'mkt-btn') and contains(normalize-space(string(.)), 'Lấy link')]",
         ".//button[contains(normalize-space(string(.)), 'Lấy link') or contains(normalize-space(string(.)), 'lấy link')]",
     ]
 
-    clicked_inner = False
     for sel in inner_selectors:
         try:
             elems = []
@@ -534,98 +840,143 @@ def click_get_batch_links(driver, sub_ids=None):
             else:
                 elems = driver.find_elements(By.XPATH, sel)
             for e in elems:
-                if try_click_candidate(e):
-                    clicked_inner = True
-                    time.sleep(0.2)
-                    break
-            if clicked_inner:
-                break
+                if try_click_candidate(driver, e):
+                    return True
         except Exception:
             continue
 
-    if not clicked_inner: 
-        try:
-            for b in modal.find_elements(By.TAG_NAME, 'button'):
-                try:
-                    txt = (b.text or '').strip().lower()
-                    if 'lấy link' in txt: 
-                        if robust_click(driver, b, timeout=1.0):
-                            clicked_inner = True
-                            break
-                except Exception:
-                    continue
-        except Exception:
-            pass
+    try:
+        for b in modal.find_elements(By.TAG_NAME, 'button'):
+            try:
+                txt = (b.text or '').strip().lower()
+                if 'lấy link' in txt: 
+                    if robust_click(driver, b, timeout=1.0):
+                        return True
+            except Exception:
+                continue
+    except Exception:
+        pass
+    return False
 
-    if not clicked_inner:
-        print('Không thể click nút Lấy link trong modal')
-        return False
 
-    # after clicking inner button:  try to detect window.open URL and download if popup blocked
+def download_csv_from_url(driver, csv_url, download_dir, filename=CSV_FILENAME, clean=True):
+    """
+    Download the exported CSV with the browser's cookies and save it as `filename` in download_dir.
+    clean=False keeps the CSVs already there (earlier parts of a multi-part harvest).
+    """
+    import requests
+    print("Detected download URL:", csv_url)
+    cookie_jar = {}
     try:
-        import requests, pathlib
-        csv_url = None
-        for _ in range(18):
+        for c in driver.get_cookies():
+            cookie_jar[c['name']] = c['value']
+    except Exception:
+        pass
+    headers = {
+        "User-Agent": driver.execute_script("return navigator.userAgent") or "Mozilla/5.0",
+        "Referer": TARGET_URL
+    }
+    if csv_url.startswith("//"):
+        csv_url = "https:" + csv_url
+    elif csv_url.startswith("/"):
+        parsed = urlparse(driver.current_url)
+        csv_url = f"{parsed.scheme}://{parsed.hostname}{csv_url}"
+    # --- clean old CSV files before saving new one ---
+    os.makedirs(download_dir, exist_ok=True)
+    for f in os.listdir(download_dir) if clean else []:
+        if f.lower().endswith(".csv"):
             try:
-                url = driver.execute_script("return window._last_opened_url || null;")
-                if url:
-                    csv_url = url
-                    break
+                os.remove(os.path.join(download_dir, f))
             except Exception:
                 pass
-            time.sleep(0.2)
+    r = requests.get(csv_url, cookies=cookie_jar, headers=headers, stream=True, timeout=20)
+    r.raise_for_status()
+    target_path = os.path.join(download_dir, filename)
+    with open(target_path, "wb") as fh:
+        for chunk in r.iter_content(8192):
+            if chunk:
+                fh.write(chunk)
+    print("Saved CSV to:", target_path)
+    return target_path
+
+
+def click_get_batch_links(driver, sub_ids=None, download_dir=None, part=0):
+    """
+    Click "Lấy link hàng loạt", wait for modal, fill Sub_id fields, click inner "Lấy link" and fallback-download CSV if popup blocked.
+    The CSV is saved as CSV_FILENAME inside download_dir (defaults to DOWNLOAD_DIR); parts > 0 of a
+    multi-part harvest are saved next to it (see merge_csv_parts).
+    """
+    download_dir = download_dir or DOWNLOAD_DIR
+    # inject override to capture window.open calls (fallback to download via requests when popup blocked)
+    install_window_open_capture(driver)
+
+    with timed(driver, 'modal') as span:
+        modal = open_batch_link_modal(driver)
+        span['ok'] = modal is not None
+    if modal is None:
+        return False
+
+    # Fill Sub_id fields if provided
+    if sub_ids: 
+        with timed(driver, 'sub_id_fill'):
+            fill_sub_ids(driver, modal, sub_ids)
+
+    with timed(driver, 'csv_download') as span:
+        span['ok'] = fetch_batch_link_csv(driver, modal, download_dir, part)
+    return span['ok']
+
+
+def open_batch_link_modal(driver):
+    """Click "Lấy link hàng loạt" and return the modal body once it is rendered, None on failure."""
+    # try to find and click main trigger
+    clicked_main = False
+    for cand in find_batch_link_buttons(driver):
+        if try_click_candidate(driver, cand):
+            clicked_main = True
+            break
+
+    if not clicked_main: 
+        print('Không tìm/không click được nút Lấy link hàng loạt')
+        return None
+
+    # wait for modal (resolves on the DOM mutation that renders it)
+    if not wait_for_selector(driver, '.ant-modal-body', 8, 'modal', visible=True):
+        print('Modal không hiển thị sau khi click Lấy link hàng loạt')
+        return None
+    wait_for_dom_quiet(driver, 2, 'modal')
+
+    try:
+        return driver.find_element(By.CSS_SELECTOR, '.ant-modal-body')
+    except Exception:
+        print('Không tìm thấy modal sau khi mở.')
+        return None
+
+
+def fetch_batch_link_csv(driver, modal, download_dir, part=0):
+    """Click the inner "Lấy link" and download the CSV (fallback when the popup is blocked)."""
+    if not click_modal_get_link(driver, modal):
+        print('Không thể click nút Lấy link trong modal')
+        return False
+
+    # after clicking inner button:  try to detect window.open URL and download if popup blocked
+    try:
+        csv_url = wait_for(driver, "window._last_opened_url", 3.6, 'download')
 
         if csv_url:
-            print("Detected download URL:", csv_url)
-            cookie_jar = {}
-            try:
-                for c in driver.get_cookies():
-                    cookie_jar[c['name']] = c['value']
-            except Exception:
-                pass
-            headers = {
-                "User-Agent": driver.execute_script("return navigator.userAgent") or "Mozilla/5.0",
-                "Referer": TARGET_URL
-            }
-            if csv_url.startswith("//"):
-                csv_url = "https:" + csv_url
-            elif csv_url.startswith("/"):
-                parsed = urlparse(driver.current_url)
-                csv_url = f"{parsed.scheme}://{parsed.hostname}{csv_url}"
-            # --- clean old CSV files before saving new one ---
-            for f in os.listdir(DOWNLOAD_DIR):
-                if f.lower().endswith(".csv"):
-                    try:
-                        os.remove(os.path.join(DOWNLOAD_DIR, f))
-                    except Exception:
-                        pass
-            r = requests.get(csv_url, cookies=cookie_jar, headers=headers, stream=True, timeout=20)
-            r.raise_for_status()
-            fixed_filename = "shopee_affiliate_links.csv"
-            target_path = os.path.join(DOWNLOAD_DIR, fixed_filename)
-            with open(target_path, "wb") as fh:
-                for chunk in r.iter_content(8192):
-                    if chunk:
-                        fh.write(chunk)
-            print("Saved CSV to:", target_path)
+            filename = CSV_FILENAME if part == 0 else f'part_{part + 1}.csv'
+            download_csv_from_url(driver, csv_url, download_dir, filename, clean=part == 0)
         else:
             print("No window.open URL detected; maybe modal returned links inside DOM or popup allowed handled the download.")
     except Exception as e:
         print("Fallback download error:", e)
 
-    try:
-        WebDriverWait(driver, 6).until(EC.invisibility_of_element_located((By.CSS_SELECTOR, '.ant-modal-body')))
-        time.sleep(0.2)
-    except Exception:
-        time.sleep(0.5)
+    wait_for_selector_gone(driver, '.ant-modal-body', 6, 'modal_close')
 
     print('Đã click Lấy link hàng loạt -> Lấy link')
     return True
 
 
-def login_with_cookie_json(search_query=None, sub_ids=None):
-    cookies, local_items = load_cookies_from_json(COOKIE_JSON_FILE)
-
+def build_chrome_options():
     options = uc.ChromeOptions()
     if HEADLESS:
         options.add_argument('--headless=new')
@@ -644,41 +995,417 @@ def login_with_cookie_json(search_query=None, sub_ids=None):
         "profile.default_content_setting_values.popups": 1,
     }
     options.add_experimental_option("prefs", prefs)
+    if CAPTURE_NETWORK or BLOCK_RESOURCES or EXTRA_BLOCKED_URLS:
+        # network events of the perf log: captured API responses and blocked-request counts
+        options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    return options
 
-    driver = uc.Chrome(options=options)
 
-    try:
+def create_driver(user_data_dir=None):
+    """Start Chrome, on a persistent profile directory when user_data_dir is given."""
+    if user_data_dir:
+        return uc.Chrome(options=build_chrome_options(), user_data_dir=user_data_dir)
+    return uc.Chrome(options=build_chrome_options())
+
+
+def prepare_driver(driver):
+    """Per-browser CDP setup (request tracker, captcha observer, network capture, resource blocking), done once."""
+    if getattr(driver, "_prepared", False):
+        return
+    setup_tab_network(driver)
+    install_request_tracker(driver)
+    install_captcha_observer(driver)
+    driver._prepared = True
+
+
+def session_is_authenticated(driver):
+    """Health check of a parked driver: not redirected to login and the offer search input is rendered."""
+    cur = (driver.current_url or '').lower()
+    if 'login' in cur or 'sign' in cur:
+        return False
+    return find_search_input(driver) is not None
+
+
+def bootstrap_session(driver, cookies, local_items):
+    """
+    Apply cookies + localStorage and park the driver on OFFER_PATH.
+    Returns True when the session is authenticated and the offer page is reachable.
+    """
+    prepare_driver(driver)
+    with timed(driver, 'add_cookies'):
         add_cookies_to_driver(driver, cookies, TARGET_URL)
-        if local_items:
+    if local_items:
+        with timed(driver, 'local_storage'):
             import_local_storage(driver, local_items, TARGET_URL)
 
-        time.sleep(0.8)
-        cur = driver.current_url.lower()
-        if 'login' in cur or 'sign' in cur:
-            print('Cookie không hợp lệ/đã hết hạn - vui lòng export lại cookie mới')
-            if not KEEP_BROWSER_OPEN:
-                driver.quit(); return
-        else:
-            print('Cookie applied - tiếp tục')
+    wait_for_document_ready(driver, DEFAULT_WAIT, 'bootstrap')
+    cur = driver.current_url.lower()
+    if 'login' in cur or 'sign' in cur:
+        print('Cookie không hợp lệ/đã hết hạn - vui lòng export lại cookie mới')
+        return False
+    print('Cookie applied - tiếp tục')
+
+    with timed(driver, 'navigate_offer') as span:
+        ok = span['ok'] = try_navigate_offer_with_retries(driver, TARGET_URL, OFFER_PATH, ALTERNATE_PATHS, MAX_OFFER_ATTEMPTS)
+    if not ok:
+        print('Không vào được offer, dừng')
+    return ok
+
+
+def return_to_offer(driver, max_attempts=2):
+    """Park an already-authenticated driver back on OFFER_PATH so the next search starts from a clean page."""
+    return try_navigate_offer_with_retries(driver, TARGET_URL, OFFER_PATH, ALTERNATE_PATHS, max_attempts)
+
+
+def run_search(driver, search_query, sub_ids=None, download_dir=None, max_pages=None, max_results=None,
+               min_commission_rate=None):
+    """
+    Run search -> commission filter -> select all -> batch link on a driver already parked on the offer page.
+    Up to max_pages result pages (or until max_results products, or until rows drop below
+    min_commission_rate) are selected, see harvest_links.
+    When download_dir is given the CSV (native download or fallback) lands there instead of DOWNLOAD_DIR.
+    With CAPTURE_NETWORK the products of the rendered result pages are written to products.json
+    in download_dir as soon as they load, before the CSV round-trip.
+    Returns True when the batch link flow was clicked through.
+    """
+    pop_wait_report(driver)  # waits/spans/blocked requests of this search only (not of parking/bootstrap)
+    pop_timings(driver)
+    pop_blocked_report(driver)
+    if download_dir:
+        set_download_dir(driver, download_dir)
+    capture = get_network_capture(driver)
+    if capture is not None:
+        capture.reset()
+    products = {}
+    with timed(driver, 'search') as span:
+        span['ok'] = perform_search(driver, search_query)
+    if not span['ok']:
+        print('Không tìm thấy input search')
+        return False
+    with timed(driver, 'commission_filter') as span:
+        span['ok'] = apply_commission_filter(driver)
+    if not span['ok']:
+        print('Không thể chọn bộ lọc hoa hồng')
+        return False
+    if harvest_links(driver, sub_ids=sub_ids, download_dir=download_dir, max_pages=max_pages,
+                     max_results=max_results, min_commission_rate=min_commission_rate, products=products) is None:
+        print('Không thể tick sản phẩm / click Lấy link hàng loạt / Lấy link')
+        return False
+    print('Lấy link hàng loạt:  đã click Lấy link')
+    return True
+
 
-        ok = try_navigate_offer_with_retries(driver, TARGET_URL, OFFER_PATH, ALTERNATE_PATHS, MAX_OFFER_ATTEMPTS)
-        if not ok:
-            print('Không vào được offer, dừng')
+# ---------------- MULTI-TAB ----------------
+# WebDriver only talks to one tab at a time, so tabs run "in parallel" by interleaving:
+# every round the driver visits each open tab, checks (without blocking) whether the page is
+# ready for that tab's next step, performs it and moves on. Page loads, XHRs and the CSV export
+# of all tabs progress in the browser meanwhile.
+TAB_STEP_TIMEOUT = 20  # seconds a tab may wait in one state before it is failed
+TAB_POLL_INTERVAL = 0.1
+
+
+def offer_page_url():
+    parsed = urlparse(TARGET_URL)
+    return f"{parsed.scheme}://{parsed.hostname}" + OFFER_PATH
+
+
+class TabSearch:
+    """
+    Search/filter/batch-link state machine of one keyword running in its own tab.
+    OPEN -> SEARCH -> FILTER -> SELECT -> MODAL -> DOWNLOAD -> DONE (or FAILED)
+    step() is called with the driver already switched to this tab and never blocks for long.
+    """
+    # timing step names of the states (same names as the spans of run_search)
+    STEPS = {
+        "OPEN": "open_tab",
+        "SEARCH": "search",
+        "FILTER": "commission_filter",
+        "SELECT": "select_all",
+        "MODAL": "modal",
+        "DOWNLOAD": "csv_download",
+    }
+    # state -> seconds the tab may wait for the page to be ready for that state's action
+    # (each state checks the page itself: result list re-rendered, select-all ticked, modal shown...)
+    TIMEOUTS = {
+        "OPEN": TAB_STEP_TIMEOUT,
+        "SEARCH": DEFAULT_WAIT + 3,
+        "FILTER": 8,
+        "SELECT": 4,
+        "MODAL": 13,
+        "DOWNLOAD": 4,
+    }
+
+    def __init__(self, job_id, query, sub_ids=None, download_dir=None):
+        self.job_id = job_id
+        self.query = query
+        self.sub_ids = sub_ids
+        self.download_dir = download_dir or DOWNLOAD_DIR
+        self.products = {}  # captured from network responses (CAPTURE_NETWORK)
+        self.timings = {}   # step -> seconds spent in that state (wall clock, tabs interleave)
+        self.handle = None
+        self.state = None
+        self.error = None
+        self._entered_at = 0.0
+        self._list_before = ''  # result list signature before the last search / filter action
+
+    @property
+    def finished(self):
+        return self.state in ("DONE", "FAILED")
+
+    def _goto(self, state):
+        now = time.time()
+        if self.state in self.STEPS:
+            self.timings[self.STEPS[self.state]] = round(now - self._entered_at, 3)
+        self.state = state
+        self._entered_at = now
+
+    def _fail(self, error):
+        print(f"[tab {self.job_id}] {error}")
+        self.error = error
+        self._goto("FAILED")
+
+    def open(self, driver):
+        """Open a new tab on the offer page without waiting for it to load."""
+        driver.switch_to.new_window('tab')
+        self.handle = driver.current_window_handle
+        setup_tab_network(driver)
+        install_captcha_observer(driver)
+        install_request_tracker(driver)
+        driver.execute_script("window.location.href = arguments[0];", offer_page_url())
+        self._goto("OPEN")
+
+    def step(self, driver):
+        """Advance at most one state. Returns True when the tab made progress."""
+        timeout = self.TIMEOUTS[self.state]
+        state = self.state
+        try:
+            progressed = getattr(self, "_step_" + state.lower())(driver)
+        except Exception as e:
+            self._fail(f"Lỗi ở bước {state}: {e}")
+            return True
+        if not progressed and not self.finished and time.time() - self._entered_at > timeout:
+            self._fail(f"Hết thời gian chờ ở bước {state}")
+            return True
+        return progressed
+
+    def _remember_list(self, driver):
+        self._list_before = result_list_signature(driver)
+
+    def _list_settled(self, driver):
+        """Non-blocking wait_for_list_update: the list re-rendered, or stayed the same through a quiet network"""
+        return bool(driver.execute_script(f"var args = arguments[0]; return {_LIST_SETTLED};",
+                                          list_update_args(self._list_before)))
+
+    def _step_open(self, driver):
+        input_el = find_search_input(driver)
+        if input_el is None:
+            if driver.execute_script(f"return !!{CAPTCHA_FLAG};") and is_captcha_page(driver):
+                self._fail("Gặp captcha khi mở tab offer")
+                return True
+            return False
+        try:
+            input_el.click()
+            input_el.clear()
+        except Exception:
+            pass
+        self._remember_list(driver)
+        input_el.send_keys(self.query)
+        input_el.send_keys(Keys.ENTER)
+        self._goto("SEARCH")
+        return True
+
+    def _step_search(self, driver):
+        # the filter radios exist before the search response: wait for the searched list itself
+        if not self._list_settled(driver):
+            return False
+        radios = driver.find_elements(By.CSS_SELECTOR, COMMISSION_RADIO_SELECTOR)
+        labels = [] if radios else [lbl for lbl in driver.find_elements(By.CSS_SELECTOR, 'label.ant-radio-button-wrapper')
+                                    if 'hoa hồng' in (lbl.text or '').lower()]
+        if not radios and not labels:
+            return False
+        self._remember_list(driver)
+        driver.execute_script('arguments[0].click();', (radios or labels)[0])
+        self._goto("FILTER")
+        return True
+
+    def _step_filter(self, driver):
+        # same for the select-all checkbox: only tick once the list re-rendered in commission order
+        if not self._list_settled(driver):
+            return False
+        checkbox = find_select_all_checkbox(driver)
+        if checkbox is None:
+            return False
+        driver.execute_script('arguments[0].click();', checkbox)
+        self._goto("SELECT")
+        return True
+
+    def _step_select(self, driver):
+        checkbox = find_select_all_checkbox(driver)
+        if checkbox is not None and not checkbox.is_selected():
+            return False  # select-all click not applied yet
+        candidates = find_batch_link_buttons(driver)
+        if not candidates:
+            return False
+        # each tab has its own JS context, so the window.open capture is installed per tab
+        install_window_open_capture(driver)
+        set_download_dir(driver, self.download_dir)
+        capture_products(driver, self.products, self.download_dir, self.handle)
+        for cand in candidates:
+            if try_click_candidate(driver, cand):
+                self._goto("MODAL")
+                return True
+        return False
+
+    def _step_modal(self, driver):
+        modal = find_visible_modal(driver)
+        if modal is None:
+            return False
+        if self.sub_ids:
+            fill_sub_ids(driver, modal, self.sub_ids)
+        if not click_modal_get_link(driver, modal):
+            self._fail('Không thể click nút Lấy link trong modal')
+            return True
+        self._goto("DOWNLOAD")
+        return True
+
+    def _step_download(self, driver):
+        csv_url = read_last_opened_url(driver)
+        if csv_url:
+            download_csv_from_url(driver, csv_url, self.download_dir)
+            self._goto("DONE")
+            return True
+        if time.time() - self._entered_at >= self.TIMEOUTS["DOWNLOAD"] - TAB_POLL_INTERVAL:
+            # same as click_get_batch_links: the popup may have handled the download natively
+            print("No window.open URL detected; maybe modal returned links inside DOM or popup allowed handled the download.")
+            self._goto("DONE")
+            return True
+        return False
+
+
+def run_searches_in_tabs(driver, searches, max_tabs=3, on_start=None, on_done=None):
+    """
+    Run several keywords concurrently in up to max_tabs tabs of one authenticated driver.
+    searches: list of (job_id, query, sub_ids, download_dir).
+    on_start(job_id) is called when a tab is opened for the keyword, on_done(job_id, ok, error, timings, blocked)
+    when it finishes (timings: {step: seconds} of that tab, blocked: its pop_blocked_report or None).
+    The driver is switched back to its original tab before returning.
+    """
+    base_handle = driver.current_window_handle
+    capture = get_network_capture(driver)
+    if capture is not None:
+        capture.reset()
+    pop_blocked_report(driver)
+    pending = [TabSearch(*s) for s in searches]
+    pending.reverse()
+    active = []
+    try:
+        while pending or active:
+            while pending and len(active) < max(1, max_tabs):
+                tab = pending.pop()
+                if on_start:
+                    on_start(tab.job_id)
+                try:
+                    tab.open(driver)
+                except Exception as e:
+                    tab._fail(f"Không mở được tab mới: {e}")
+                active.append(tab)
+
+            progressed = False
+            for tab in list(active):
+                if not tab.finished:
+                    try:
+                        driver.switch_to.window(tab.handle)
+                    except Exception as e:
+                        tab._fail(f"Tab đã bị đóng: {e}")
+                    else:
+                        progressed = tab.step(driver) or progressed
+                if tab.finished:
+                    active.remove(tab)
+                    _close_tab(driver, tab.handle, base_handle)
+                    if on_done:
+                        on_done(tab.job_id, tab.state == "DONE", tab.error, tab.timings,
+                                pop_blocked_report(driver, tab.handle))
+                    progressed = True
+            if not progressed:
+                time.sleep(TAB_POLL_INTERVAL)
+    finally:
+        for tab in active:
+            _close_tab(driver, tab.handle, base_handle)
+        try:
+            driver.switch_to.window(base_handle)
+        except Exception:
+            pass
+
+
+def _close_tab(driver, handle, base_handle):
+    if not handle or handle == base_handle:
+        return
+    try:
+        driver.switch_to.window(handle)
+        driver.close()
+    except Exception:
+        pass
+    try:
+        driver.switch_to.window(base_handle)
+    except Exception:
+        pass
+
+
+def launch_browser(profile=None):
+    """Start Chrome (on the given ChromeProfile, if any); the launch is timed on the driver."""
+    t0 = time.time()
+    driver = create_driver(profile.path if profile else None)
+    step_timer(driver).record('chrome_launch', t0, time.time() - t0)
+    return driver
+
+
+def open_session(driver, profile=None, cookie_file=None):
+    """
+    Make a freshly launched driver authenticated and parked on OFFER_PATH. Returns True on success.
+    A seeded profile goes straight to the offer page and is only re-seeded from cookie_file
+    (cookies + localStorage, default COOKIE_JSON_FILE) when the health check finds it logged out.
+    """
+    cookie_file = cookie_file or COOKIE_JSON_FILE
+    if profile is not None and profile.seeded:
+        prepare_driver(driver)
+        with timed(driver, 'profile_check') as span:
+            span['ok'] = (try_navigate_offer_with_retries(driver, TARGET_URL, OFFER_PATH, ALTERNATE_PATHS, 2)
+                          and session_is_authenticated(driver))
+        profile.mark_checked(span['ok'])
+        if span['ok']:
+            print(f'Profile {profile.name} vẫn đăng nhập - bỏ qua {cookie_file}')
+            return True
+        print(f'Profile {profile.name} đã bị đăng xuất - seed lại từ {cookie_file}')
+
+    with timed(driver, 'cookie_load'):
+        cookies, local_items = load_cookies_from_json(cookie_file)
+    ok = bootstrap_session(driver, cookies, local_items)
+    if profile is not None:
+        profile.mark_seeded(ok and session_is_authenticated(driver))
+    return ok
+
+
+def login_with_cookie_json(search_query=None, sub_ids=None, profile_dir=None, max_pages=None, max_results=None,
+                           min_commission_rate=None):
+    profile = ChromeProfile(profile_dir) if profile_dir else None
+    driver = launch_browser(profile)
+
+    try:
+        if not open_session(driver, profile):
+            print('Thời gian các bước:', format_timings(durations(pop_timings(driver))))
             if not KEEP_BROWSER_OPEN:
                 driver.quit(); return
+        print('Khởi động:', format_timings(durations(pop_timings(driver))))
 
         if search_query:
-            if not perform_search(driver, search_query):
-                print('Không tìm thấy input search')
-            else:
-                if click_commission_and_select_all(driver):
-                    # select_all_on_multiple_pages(driver, 2, 5)
-                    if click_get_batch_links(driver, sub_ids=sub_ids):
-                        print('Lấy link hàng loạt:  đã click Lấy link')
-                    else:
-                        print('Không thể click Lấy link hàng loạt / Lấy link')
-                else:
-                    print('Không thể chọn bộ lọc hoa hồng / tick tất cả')
+            run_search(driver, search_query, sub_ids=sub_ids, max_pages=max_pages, max_results=max_results,
+                       min_commission_rate=min_commission_rate)
+            print('Thời gian các bước:', format_timings(durations(pop_timings(driver))))
+            blocked = pop_blocked_report(driver)
+            if blocked:
+                print(f"Đã chặn {blocked['requests']} request (~{blocked['bytes_saved'] // 1024} KB): {blocked['by_type']}")
+            for step, w in pop_wait_report(driver).items():
+                print(f"Chờ {step}: {w['waited']}s ({w['count']} lần, {w['timeouts']} timeout)")
 
         print('Xong. Giữ trình duyệt mở để kiểm tra.' if KEEP_BROWSER_OPEN else 'Xong. Đóng trình duyệt.')
         if KEEP_BROWSER_OPEN:
@@ -697,6 +1424,11 @@ if __name__ == '__main__':
     parser.add_argument('--sub-id1', type=str, default='', help='Sub_id1 value')
     parser.add_argument('--sub-id2', type=str, default='', help='Sub_id2 value')
     parser.add_argument('--sub-id3', type=str, default='', help='Sub_id3 value')
+    parser.add_argument('--profile', type=str, default=None, help='Persistent Chrome user-data-dir (reused across runs)')
+    parser.add_argument('--max-pages', type=int, default=None, help='Result pages to harvest (default 1, or enough for --max-results)')
+    parser.add_argument('--max-results', type=int, default=None, help='Stop once this many products are selected')
+    parser.add_argument('--min-commission-rate', type=float, default=None,
+                        help='Stop paginating once rows fall below this commission rate (%%)')
     args = parser.parse_args()
     
     search_query = ' '.join(args.query).strip() if args.query else ''
@@ -707,4 +1439,6 @@ if __name__ == '__main__':
         'sub_id3': args.sub_id3,
     }
     
-    login_with_cookie_json(search_query=search_query, sub_ids=sub_ids)
\ No newline at end of file
+    login_with_cookie_json(search_query=search_query, sub_ids=sub_ids, profile_dir=args.profile,
+                           max_pages=args.max_pages, max_results=args.max_results,
+                           min_commission_rate=args.min_commission_rate)
\ No newline at end of file
@@ -0,0 +1,53 @@
+"""
+Gộp các search giống nhau đang chạy (single-flight): với mỗi key chỉ có 1 job
+leader thật sự chạy Chrome, các request trùng key trong lúc đó được gắn vào
+leader dưới dạng job con và nhận cùng kết quả khi leader xong.
+"""
+import threading
+
+
+class SingleFlight:
+    def __init__(self):
+        self._inflight = {}  # key -> {"leader": job_id, "followers": [job_id, ...]}
+        self._lock = threading.Lock()
+
+    def join(self, key, job_id, on_follow=None):
+        """
+        Đăng ký job_id cho key. Trả về None nếu job_id trở thành leader (cần chạy scraper),
+        ngược lại trả về job_id của leader đang chạy mà job_id vừa được gắn vào.
+        on_follow(leader_id) được gọi trong lock trước khi gắn job con (vd tạo record của job con),
+        nên complete() của leader không thể trả về job con chưa có record.
+        """
+        with self._lock:
+            flight = self._inflight.get(key)
+            if flight is None:
+                self._inflight[key] = {"leader": job_id, "followers": []}
+                return None
+            if on_follow is not None:
+                on_follow(flight["leader"])
+            flight["followers"].append(job_id)
+            return flight["leader"]
+
+    def followers(self, key, leader_id):
+        """Các job con đang gắn vào leader (không kết thúc flight)"""
+        with self._lock:
+            flight = self._inflight.get(key)
+            if flight is None or flight["leader"] != leader_id:
+                return []
+            return list(flight["followers"])
+
+    def complete(self, key, leader_id):
+        """Kết thúc flight của leader, trả về danh sách job con cần cập nhật kết quả"""
+        with self._lock:
+            flight = self._inflight.get(key)
+            if flight is None or flight["leader"] != leader_id:
+                return []
+            del self._inflight[key]
+            return flight["followers"]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._inflight),
+                "followers": sum(len(f["followers"]) for f in self._inflight.values()),
+            }
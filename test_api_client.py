@@ -1,17 +1,21 @@
 """
 Script test các API endpoints
 Usage:  python test_api_client.py
+        python test_api_client.py --webhook-receiver [port]   (nhận webhook callback_url=http://localhost:5055/)
 """
 
 import requests
+import sys
 import time
 import json
+from http.server import BaseHTTPRequestHandler, HTTPServer
 from colorama import Fore, Style, init
 
 # Khởi tạo colorama
 init(autoreset=True)
 
 BASE_URL = "http://localhost:5000"
+WEBHOOK_PORT = 5055
 
 def print_response(title, response):
     """In response một cách đẹp"""
@@ -71,15 +75,16 @@ def test_search_affiliate(keyword, sub_id1=None, sub_id2=None, sub_id3=None):
         print(f"{Fore.RED}Lỗi: {e}{Style.RESET_ALL}")
         return None
 
-def test_polling(job_id, max_attempts=30):
-    """Test polling"""
+def test_polling(job_id, max_attempts=30, wait=30):
+    """Test polling (long-poll: server giữ request tối đa `wait` giây tới khi job đổi trạng thái)"""
     print(f"\n{Fore.GREEN}[3] Testing Polling (job_id:  '{job_id}'){Style.RESET_ALL}")
     
     for attempt in range(max_attempts):
         try:
             response = requests.get(
                 f"{BASE_URL}/polling",
-                params={"job_id": job_id}
+                params={"job_id": job_id, "wait": wait},
+                timeout=wait + 10
             )
             data = response.json()
             print_response(f"Polling Response (Attempt {attempt + 1}/{max_attempts})", response)
@@ -87,13 +92,16 @@ def test_polling(job_id, max_attempts=30):
             if data.get('job_status') == 'completed':
                 print(f"\n{Fore.GREEN}✓ Tìm kiếm hoàn thành!  {Style.RESET_ALL}")
                 return True
+            if data.get('job_status') == 'failed':
+                print(f"\n{Fore.RED}✗ Tìm kiếm thất bại: {data.get('error')}{Style.RESET_ALL}")
+                return False
             
             print(f"{Fore.YELLOW}Đang chờ... ({attempt + 1}/{max_attempts}){Style.RESET_ALL}")
-            time.sleep(5)  # Chờ 5 giây trước khi poll lại
             
         except Exception as e:
+            # Server lỗi / chưa lên: nghỉ 1 chút rồi thử lại thay vì dồn hết số lần thử
             print(f"{Fore.RED}Lỗi: {e}{Style.RESET_ALL}")
-            return False
+            time.sleep(2)
     
     print(f"{Fore.RED}✗ Timeout:   Tìm kiếm quá lâu{Style.RESET_ALL}")
     return False
@@ -137,6 +145,31 @@ def test_status():
         print(f"{Fore.RED}Lỗi:   {e}{Style.RESET_ALL}")
         return False
 
+class WebhookHandler(BaseHTTPRequestHandler):
+    """Receiver đơn giản in ra các webhook server gửi tới"""
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        try:
+            jobs = json.loads(body).get('jobs', [])
+            print(f"\n{Fore.GREEN}Nhận webhook với {len(jobs)} job:{Style.RESET_ALL}")
+            for job in jobs:
+                print(f"   {job.get('job_id')} -> {job.get('job_status')} ({job.get('result_count')} kết quả)")
+            self.send_response(200)
+        except Exception as e:
+            print(f"{Fore.RED}Webhook không hợp lệ: {e}{Style.RESET_ALL}")
+            self.send_response(400)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+def run_webhook_receiver(port=WEBHOOK_PORT):
+    """Chạy receiver webhook local"""
+    print(f"{Fore.CYAN}Webhook receiver đang chạy ở http://localhost:{port}/{Style.RESET_ALL}")
+    HTTPServer(('0.0.0.0', port), WebhookHandler).serve_forever()
+
 def main():
     """Main test flow"""
     print(f"{Fore.MAGENTA}")
@@ -187,6 +220,10 @@ def main():
 
 if __name__ == '__main__':
     try:
-        main()
+        if '--webhook-receiver' in sys.argv:
+            args = sys.argv[sys.argv.index('--webhook-receiver') + 1:]
+            run_webhook_receiver(int(args[0]) if args else WEBHOOK_PORT)
+        else:
+            main()
     except KeyboardInterrupt:
         print(f"\n{Fore.YELLOW}Đã hủy test{Style.RESET_ALL}")
\ No newline at end of file
@@ -0,0 +1,71 @@
+# Per-step timing spans of the scraper (cookie load, Chrome launch, search, filter, modal, CSV download...).
+# Spans are recorded per driver (like the wait report of page_waits) so the app can attach the breakdown
+# of one search to its job, and the CLI can print it.
+
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StepTimer:
+    """Collects timing spans {step, start, duration, ok}"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spans = []
+
+    @contextmanager
+    def span(self, step):
+        """
+        with timer.span("search") as s:
+            s["ok"] = perform_search(...)
+        ok defaults to True and is False when the block raises.
+        """
+        info = {"ok": True}
+        start = time.time()
+        try:
+            yield info
+        except BaseException:
+            info["ok"] = False
+            raise
+        finally:
+            self.record(step, start, time.time() - start, info["ok"])
+
+    def record(self, step, start, duration, ok=True):
+        with self._lock:
+            self._spans.append({"step": step, "start": start, "duration": round(duration, 3), "ok": bool(ok)})
+
+    def pop(self):
+        """Return the recorded spans and start over"""
+        with self._lock:
+            spans, self._spans = self._spans, []
+        return spans
+
+
+def step_timer(driver):
+    timer = getattr(driver, "_step_timer", None)
+    if timer is None:
+        timer = StepTimer()
+        driver._step_timer = timer
+    return timer
+
+
+def timed(driver, step):
+    """Context manager recording a span of `step` on the driver's timer"""
+    return step_timer(driver).span(step)
+
+
+def pop_timings(driver):
+    return step_timer(driver).pop()
+
+
+def durations(spans):
+    """[{step, duration}, ...] -> {step: total seconds} in first-seen order"""
+    totals = {}
+    for s in spans:
+        totals[s["step"]] = round(totals.get(s["step"], 0.0) + s["duration"], 3)
+    return totals
+
+
+def format_timings(totals):
+    return ", ".join(f"{step}={seconds:.2f}s" for step, seconds in totals.items())
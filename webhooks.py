@@ -0,0 +1,120 @@
+"""
+Gửi webhook khi job kết thúc (callback_url truyền vào /search_affiliate).
+Các job kết thúc gần nhau cùng 1 endpoint được gộp vào 1 request POST {"jobs": [...]},
+dùng chung connection pool của requests.Session, lỗi thì retry với exponential backoff.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookDispatcher:
+    def __init__(self, batch_window=1.0, max_batch=20, max_attempts=5, backoff_base=2.0,
+                 timeout=10, pool_size=10):
+        self.batch_window = batch_window   # giây gom các job cùng endpoint trước khi gửi
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base   # lần retry thứ n chờ backoff_base ** n giây
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._pending = {}   # url -> {"since": ts, "items": [...]}
+        self._retries = []   # heap (next_attempt_at, seq, url, items, attempt)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread = None
+        self.delivered = 0
+        self.failed = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="webhook-dispatcher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+
+    def enqueue(self, url, payload):
+        with self._cond:
+            entry = self._pending.setdefault(url, {"since": time.time(), "items": []})
+            entry["items"].append(payload)
+            self._cond.notify()
+
+    def _next_wakeup(self, now):
+        deadlines = [entry["since"] + self.batch_window for entry in self._pending.values()]
+        if self._retries:
+            deadlines.append(self._retries[0][0])
+        return max(0, min(deadlines) - now) if deadlines else None
+
+    def _collect_due(self):
+        """Lấy các batch đã đủ thời gian gom / đủ số lượng và các lần retry đến hạn"""
+        now = time.time()
+        due = []
+        for url in list(self._pending):
+            entry = self._pending[url]
+            if now - entry["since"] >= self.batch_window or len(entry["items"]) >= self.max_batch:
+                items = entry["items"]
+                del self._pending[url]
+                for i in range(0, len(items), self.max_batch):
+                    due.append((url, items[i:i + self.max_batch], 1))
+        while self._retries and self._retries[0][0] <= now:
+            _, _, url, items, attempt = heapq.heappop(self._retries)
+            due.append((url, items, attempt))
+        return due
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._stopping:
+                    due = self._collect_due()
+                    if due:
+                        break
+                    self._cond.wait(self._next_wakeup(time.time()))
+                if self._stopping:
+                    return
+            for url, items, attempt in due:
+                self._deliver(url, items, attempt)
+
+    def _deliver(self, url, items, attempt):
+        job_ids = [item.get("job_id") for item in items]
+        try:
+            r = self.session.post(url, json={"jobs": items}, timeout=self.timeout)
+            r.raise_for_status()
+            self.delivered += len(items)
+            logger.info(f"Webhook {url}: đã gửi {len(items)} job {job_ids}")
+            return
+        except Exception as e:
+            error = e
+
+        if attempt >= self.max_attempts:
+            self.failed += len(items)
+            logger.error(f"Webhook {url}: bỏ {len(items)} job {job_ids} sau {attempt} lần thử: {error}")
+            return
+        delay = self.backoff_base ** attempt
+        logger.warning(f"Webhook {url}: lần {attempt} lỗi ({error}), thử lại sau {delay:.0f}s")
+        with self._cond:
+            heapq.heappush(self._retries, (time.time() + delay, next(self._seq), url, items, attempt + 1))
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "pending": sum(len(entry["items"]) for entry in self._pending.values()),
+                "retrying": sum(len(r[3]) for r in self._retries),
+                "delivered": self.delivered,
+                "failed": self.failed,
+            }